@@ -1,9 +1,38 @@
+from typing import Optional
+
 from pydantic import BaseSettings
 
 
 class AppSettings(BaseSettings):
     database_url: str
     secret_key: str
+    token_expire_minutes: Optional[int] = None
+    trust_token_claims: bool = False
+    principal_cache_ttl_seconds: float = 60.0
+    principal_cache_max_size: int = 10000
+    password_hash_executor: str = "thread"
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 32
+    slow_query_ms: Optional[float] = None
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout_seconds: float = 30.0
+    db_pool_pre_ping: bool = False
+    db_pool_recycle_seconds: int = -1
+    db_statement_timeout_ms: Optional[int] = None
+    db_pgbouncer: bool = False
+    period_cache_backend: str = "memory"
+    period_cache_redis_url: str = "redis://localhost:6379/0"
+    period_cache_max_size: int = 10000
+    period_cache_current_ttl_seconds: float = 30.0
+    fx_rates_ttl_seconds: float = 3600.0
+    db_isolation_level: str = "READ COMMITTED"
+    db_write_retry_attempts: int = 6
+    log_queue_size: int = 10000
+    log_info_sample_rate: float = 1.0
+    events_backend: str = "memory"
+    events_buffer_size: int = 100
+    events_heartbeat_seconds: float = 15.0
 
     def __new__(cls):
         if not hasattr(cls, 'instance'):
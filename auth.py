@@ -1,45 +1,157 @@
+import asyncio
 import json
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable
 
 from fastapi import HTTPException
 from jose import jwt, JWTError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import validation
 import database_crud
+import log_pipeline
+import metrics
 from app_settings import AppSettings
+from cache import TTLCache
+from database_models import UserDb, SettingsDb
 
-from models import TokenData
+from models import TokenData, Settings
 
 SECRET_KEY = AppSettings().secret_key
 ALGORITHM = "HS256"
+TOKEN_EXPIRE_MINUTES = AppSettings().token_expire_minutes
+TRUST_TOKEN_CLAIMS = AppSettings().trust_token_claims
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+PASSWORD_HASH_MAX_PENDING = AppSettings().password_hash_max_pending
+password_hash_executor: Executor = None
+password_hash_pending = 0
 
-def verify_password(password: str, hashed_password: str):
-    if not pwd_context.verify(password, hashed_password):
-        raise HTTPException(status_code=401, detail="unauthorized")
+password_hash_seconds = metrics.Histogram("password_hash_seconds", "time spent inside bcrypt")
+password_hash_queue_wait_seconds = metrics.Histogram(
+    "password_hash_queue_wait_seconds", "time a password hash waited for a pool worker"
+)
+password_hash_pending_gauge = metrics.Gauge("password_hash_pending", "password hashes queued or running")
+password_hash_rejected = metrics.Counter("password_hash_rejected_total", "password hashes refused with 503")
+
+principal_cache = TTLCache(
+    max_size=AppSettings().principal_cache_max_size,
+    ttl_seconds=AppSettings().principal_cache_ttl_seconds
+)
+metrics.FunctionMetric(
+    "principal_cache_hits_total", "token verifications served from the principal cache", "counter",
+    lambda: principal_cache.hits
+)
+metrics.FunctionMetric(
+    "principal_cache_misses_total", "token verifications that looked the user up", "counter",
+    lambda: principal_cache.misses
+)
+
+
+def get_password_hash_executor() -> Executor:
+    global password_hash_executor
+    if password_hash_executor is None:
+        settings = AppSettings()
+        executor_class = ProcessPoolExecutor if settings.password_hash_executor == "process" else ThreadPoolExecutor
+        password_hash_executor = executor_class(max_workers=settings.password_hash_workers)
+    return password_hash_executor
 
 
-def get_hashed_password(password: str) -> str:
+def timed_call(function: Callable, *args) -> tuple:
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def hash_password_sync(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+async def run_password_hash(function: Callable, *args):
+    global password_hash_pending
+    if password_hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        password_hash_rejected.inc()
+        raise HTTPException(status_code=503, detail="server is busy, try again later", headers={"Retry-After": "1"})
+
+    password_hash_pending += 1
+    password_hash_pending_gauge.set(password_hash_pending)
+    submitted = time.perf_counter()
+    try:
+        result, hash_seconds = await asyncio.get_running_loop().run_in_executor(
+            get_password_hash_executor(), timed_call, function, *args
+        )
+    finally:
+        password_hash_pending -= 1
+        password_hash_pending_gauge.set(password_hash_pending)
+
+    password_hash_seconds.observe(hash_seconds)
+    password_hash_queue_wait_seconds.observe(max(time.perf_counter() - submitted - hash_seconds, 0))
+    return result
+
+
+async def verify_password(password: str, hashed_password: str):
+    if not await run_password_hash(verify_password_sync, password, hashed_password):
+        raise HTTPException(status_code=401, detail="unauthorized")
+
+
+async def get_hashed_password(password: str) -> str:
+    return await run_password_hash(hash_password_sync, password)
+
+
 def create_token(data: dict) -> str:
     payload = {
         "sub": json.dumps(data)
     }
+    if TOKEN_EXPIRE_MINUTES is not None:
+        payload["exp"] = datetime.utcnow() + timedelta(minutes=TOKEN_EXPIRE_MINUTES)
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_token(db: Session, token: str) -> int:
+async def verify_token(db: AsyncSession, token: str) -> int:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         token_data: TokenData = TokenData(**json.loads(payload["sub"]))
-        user = database_crud.get_user(db, token_data.user_id)
-        validation.validate_entity_exists(token_data.user_id, "user", user, 401)
-        return token_data.user_id
     except JWTError as error:
         raise HTTPException(status_code=401, detail=f"unauthorized: {error}")
 
+    log_pipeline.bind_user_id(token_data.user_id)
+    if TRUST_TOKEN_CLAIMS and "exp" in payload:
+        return token_data.user_id
+
+    await get_principal_settings(db, token_data.user_id)
+    return token_data.user_id
+
+
+async def get_principal_settings(db: AsyncSession, user_id: int) -> Settings:
+    settings = principal_cache.get(user_id)
+    if settings is None:
+        db_settings = await database_crud.get_user_settings(db, user_id)
+        validation.validate_entity_exists(user_id, "user", db_settings, 401)
+        settings = Settings.from_orm(db_settings)
+        principal_cache.set(user_id, settings)
+    return settings
+
+
+def invalidate_principal(user_id: int):
+    principal_cache.invalidate(user_id)
+
+
+@event.listens_for(UserDb, "after_update")
+@event.listens_for(UserDb, "after_delete")
+def _invalidate_changed_user(mapper, connection, target: UserDb):
+    invalidate_principal(target.id)
+
+
+@event.listens_for(SettingsDb, "after_update")
+@event.listens_for(SettingsDb, "after_delete")
+def _invalidate_changed_settings(mapper, connection, target: SettingsDb):
+    invalidate_principal(target.user_id)
@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from datetime import datetime
+
+import httpx
+from sqlalchemy import select
+
+import auth
+from benchmarks import seed
+from database import engine
+from database_models import CategoryDb
+from models import CategoryType, TokenData
+
+# (operation, weight) pairs approximating dashboard traffic
+REQUEST_MIX = [
+    ("GET /state", 5),
+    ("GET /incomes", 15),
+    ("GET /expenses", 20),
+    ("GET /accounts", 15),
+    ("GET /time-series", 5),
+    ("GET /categories/{id}", 10),
+    ("GET /categories/{id}/transactions", 10),
+    ("POST /account-expense-transactions", 15),
+    ("POST /income-account-transactions", 5),
+    ("DELETE /categories/{id}", 1),
+]
+
+
+class Scenario:
+
+    def __init__(self, user_ids: list[int], random_seed: int):
+        self.generator = random.Random(random_seed)
+        self.users = {}
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(CategoryDb.id, CategoryDb.user_id, CategoryDb.type, CategoryDb.name)
+                .where(CategoryDb.user_id.in_(user_ids))
+            ).all()
+
+        for user_id in user_ids:
+            self.users[user_id] = {
+                "token": auth.create_token(TokenData(user_id=user_id).dict()),
+                CategoryType.INCOME: [],
+                CategoryType.ACCOUNT: [],
+                CategoryType.EXPENSE: [],
+                "deletable": []
+            }
+        for category_id, user_id, category_type, name in rows:
+            if name.startswith(seed.DELETABLE_PREFIX):
+                self.users[user_id]["deletable"].append(category_id)
+            else:
+                self.users[user_id][CategoryType(category_type)].append(category_id)
+
+    def next_request(self) -> tuple[int, str, str, str, dict]:
+        user_id = self.generator.choice(list(self.users))
+        operation, method, path, kwargs = self.build_request(self.users[user_id])
+        return user_id, operation, method, path, kwargs
+
+    def build_request(self, user: dict) -> tuple[str, str, str, dict]:
+        operations, weights = zip(*REQUEST_MIX)
+        operation = self.generator.choices(operations, weights)[0]
+        if operation == "DELETE /categories/{id}" and not user["deletable"]:
+            operation = "GET /accounts"
+
+        period = {"period_offset": -self.generator.randrange(12)}
+        timestamp = datetime.utcnow().isoformat()
+        if operation == "GET /state":
+            return operation, "GET", "/state", {}
+        if operation == "GET /incomes":
+            return operation, "GET", "/incomes", {"params": period}
+        if operation == "GET /expenses":
+            return operation, "GET", "/expenses", {"params": period}
+        if operation == "GET /accounts":
+            return operation, "GET", "/accounts", {}
+        if operation == "GET /time-series":
+            return operation, "GET", "/time-series", {"params": {"type": CategoryType.EXPENSE.value}}
+        if operation == "GET /categories/{id}":
+            category_id = self.generator.choice(user[CategoryType.EXPENSE])
+            return operation, "GET", f"/categories/{category_id}", {"params": period}
+        if operation == "GET /categories/{id}/transactions":
+            category_id = self.generator.choice(user[CategoryType.ACCOUNT])
+            return operation, "GET", f"/categories/{category_id}/transactions", {"params": period}
+        if operation == "POST /account-expense-transactions":
+            return operation, "POST", "/account-expense-transactions", {"json": {
+                "amount": round(self.generator.uniform(1, 200), 2),
+                "source": self.generator.choice(user[CategoryType.ACCOUNT]),
+                "destination": self.generator.choice(user[CategoryType.EXPENSE]),
+                "timestamp": timestamp
+            }}
+        if operation == "POST /income-account-transactions":
+            return operation, "POST", "/income-account-transactions", {"json": {
+                "amount": round(self.generator.uniform(500, 5000), 2),
+                "source": self.generator.choice(user[CategoryType.INCOME]),
+                "destination": self.generator.choice(user[CategoryType.ACCOUNT]),
+                "timestamp": timestamp
+            }}
+        return operation, "DELETE", f"/categories/{user['deletable'].pop()}", {}
+
+    def headers(self, user_id: int) -> dict:
+        return {"Authorization": f"Bearer {self.users[user_id]['token']}"}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples: dict[str, list], duration: float) -> dict:
+    summary = {}
+    for operation, results in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in results)
+        summary[operation] = {
+            "count": len(results),
+            "errors": sum(1 for _, ok in results if not ok),
+            "throughput_rps": round(len(results) / duration, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        }
+    return summary
+
+
+async def run_level(client: httpx.AsyncClient, scenario: Scenario, concurrency: int, requests: int) -> dict:
+    samples: dict[str, list] = {}
+    remaining = [requests]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            user_id, operation, method, path, kwargs = scenario.next_request()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, headers=scenario.headers(user_id), **kwargs)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            samples.setdefault(operation, []).append((time.perf_counter() - started, ok))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started
+
+    total = sum(len(results) for results in samples.values())
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(total / duration, 2),
+        "endpoints": summarize(samples, duration)
+    }
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if args.skip_seed:
+        with engine.connect() as connection:
+            user_ids = seed.get_bench_user_ids(connection)
+    else:
+        user_ids = seed.seed_from_arguments(args)
+    scenario = Scenario(user_ids, args.random_seed)
+
+    if args.base_url is None:
+        import main
+        client = httpx.AsyncClient(app=main.app, base_url="http://benchmark/api/v1", timeout=60)
+    else:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+
+    async with client:
+        levels = [await run_level(client, scenario, concurrency, args.requests) for concurrency in args.concurrency]
+
+    return {
+        "commit": get_git_commit(),
+        "started_at": datetime.utcnow().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "levels": levels
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="seed synthetic data and replay a request mix against the API")
+    seed.add_seed_arguments(parser)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse previously seeded benchmark users")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--base-url", default=None, help="target a running server instead of main.app in-process")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as output:
+            output.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import json
+
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, text, func
+
+import utils
+from database import engine
+from database_models import CategoryDb, TransactionDb
+from models import CategoryType
+
+INDEX_REVISION = "0002"
+
+
+def get_sample(connection) -> dict:
+    busiest_category_id = connection.execute(
+        select(TransactionDb.source).group_by(TransactionDb.source).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    user_id = connection.execute(
+        select(CategoryDb.user_id).where(CategoryDb.id == busiest_category_id)
+    ).scalar()
+    period_start, period_end = utils.get_period(0)
+    return {
+        "category_id": busiest_category_id,
+        "user_id": user_id,
+        "period_start": period_start - relativedelta(months=11),
+        "period_end": period_end
+    }
+
+
+def get_queries(sample: dict) -> dict:
+    in_period = [
+        TransactionDb.timestamp >= sample["period_start"],
+        TransactionDb.timestamp < sample["period_end"]
+    ]
+    return {
+        "get_category_transactions.source": select(TransactionDb)
+        .where(TransactionDb.source == sample["category_id"])
+        .where(*in_period),
+        "get_category_transactions.destination": select(TransactionDb)
+        .where(TransactionDb.destination == sample["category_id"])
+        .where(*in_period),
+        "get_category_period_sum.source": select(func.sum(TransactionDb.amount))
+        .where(TransactionDb.source == sample["category_id"])
+        .where(*in_period),
+        "get_category_period_sum.destination": select(func.sum(TransactionDb.amount))
+        .where(TransactionDb.destination == sample["category_id"])
+        .where(*in_period),
+        "get_transactions": select(TransactionDb)
+        .where(TransactionDb.user_id == sample["user_id"])
+        .order_by(TransactionDb.timestamp.desc())
+        .limit(100),
+        "get_expenses": select(CategoryDb)
+        .where(CategoryDb.user_id == sample["user_id"])
+        .where(CategoryDb.type == CategoryType.EXPENSE.value),
+    }
+
+
+def explain(connection, statement) -> dict:
+    compiled = statement.compile(dialect=connection.dialect)
+    explain_sql = f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}"
+    plan = connection.exec_driver_sql(explain_sql, compiled.params).scalar()[0]
+    return {
+        "node": plan["Plan"]["Node Type"],
+        "index": plan["Plan"].get("Index Name"),
+        "total_cost": plan["Plan"]["Total Cost"],
+        "execution_ms": plan["Execution Time"],
+        "plan": plan["Plan"]
+    }
+
+
+def explain_all(connection, sample: dict) -> dict:
+    connection.execute(text("ANALYZE transactions"))
+    connection.execute(text("ANALYZE categories"))
+    return {name: explain(connection, statement) for name, statement in get_queries(sample).items()}
+
+
+def explain_without_indexes(sample: dict) -> dict:
+    indexes = ScriptDirectory.from_config(Config("alembic.ini")).get_revision(INDEX_REVISION).module.INDEXES
+    with engine.connect() as connection:
+        # DDL is transactional in postgres: the rollback restores the indexes without touching the rest of the schema
+        transaction = connection.begin()
+        try:
+            for name, _, _ in indexes:
+                connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            return explain_all(connection, sample)
+        finally:
+            transaction.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE the transaction hot-path queries")
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help=f"explain without the revision {INDEX_REVISION} indexes, then again with them"
+    )
+    parser.add_argument("--full-plans", action="store_true", help="include the complete plan trees in the output")
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        sample = get_sample(connection)
+
+    report = {"sample": {key: str(value) for key, value in sample.items()}}
+    if args.compare:
+        report["before"] = explain_without_indexes(sample)
+    with engine.connect() as connection:
+        report["after" if args.compare else "current"] = explain_all(connection, sample)
+
+    if not args.full_plans:
+        for key in ("before", "after", "current"):
+            for result in report.get(key, {}).values():
+                del result["plan"]
+
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+
+import auth
+import database_crud
+import utils
+from database import engine
+from database_models import UserDb, SettingsDb, CategoryDb, TransactionDb, CategoryPeriodTotalDb, IdempotencyKeyDb, \
+    ChangeDb
+from models import CategoryType, Currency
+
+LOGIN_PREFIX = "bench-user-"
+DELETABLE_PREFIX = "bench-delete-"
+INSERT_CHUNK_SIZE = 5000
+
+
+def get_bench_user_ids(connection) -> list[int]:
+    return connection.execute(
+        select(UserDb.id).where(UserDb.login.like(f"{LOGIN_PREFIX}%")).order_by(UserDb.id)
+    ).scalars().all()
+
+
+def clear(connection):
+    user_ids = select(UserDb.id).where(UserDb.login.like(f"{LOGIN_PREFIX}%"))
+    category_ids = select(CategoryDb.id).where(CategoryDb.user_id.in_(user_ids))
+    connection.execute(delete(CategoryPeriodTotalDb).where(CategoryPeriodTotalDb.category_id.in_(category_ids)))
+    connection.execute(delete(TransactionDb).where(TransactionDb.user_id.in_(user_ids)))
+    connection.execute(delete(CategoryDb).where(CategoryDb.user_id.in_(user_ids)))
+    connection.execute(delete(SettingsDb).where(SettingsDb.user_id.in_(user_ids)))
+    connection.execute(delete(IdempotencyKeyDb).where(IdempotencyKeyDb.user_id.in_(user_ids)))
+    connection.execute(delete(ChangeDb).where(ChangeDb.user_id.in_(user_ids)))
+    connection.execute(delete(UserDb).where(UserDb.id.in_(user_ids)))
+
+
+def create_categories(connection, user_id: int, names: list[str], category_type: CategoryType) -> list[int]:
+    if not names:
+        return []
+    return connection.execute(
+        insert(CategoryDb).values([
+            {"name": name, "type": category_type.value, "amount": 0, "currency": Currency.EUR.value, "user_id": user_id}
+            for name in names
+        ]).returning(CategoryDb.id)
+    ).scalars().all()
+
+
+def generate_transactions(
+        generator: random.Random,
+        user_id: int,
+        incomes: list[int],
+        accounts: list[int],
+        expenses: list[int],
+        months: int,
+        transactions_per_month: int
+) -> list[dict]:
+    now = datetime.utcnow()
+    start = now - timedelta(days=30 * months)
+    rows = []
+    for _ in range(months * transactions_per_month):
+        timestamp = start + timedelta(seconds=generator.uniform(0, (now - start).total_seconds()))
+        if generator.random() < 0.1:
+            source, destination = generator.choice(incomes), generator.choice(accounts)
+            amount = utils.to_money(generator.uniform(500, 5000))
+        else:
+            source, destination = generator.choice(accounts), generator.choice(expenses)
+            amount = utils.to_money(generator.uniform(1, 200))
+        rows.append({
+            "amount": amount, "source": source, "destination": destination, "user_id": user_id, "timestamp": timestamp
+        })
+    return rows
+
+
+def seed(
+        users: int,
+        incomes: int,
+        accounts: int,
+        expenses: int,
+        deletable: int,
+        years: float,
+        transactions_per_month: int,
+        random_seed: int = 0
+) -> list[int]:
+    generator = random.Random(random_seed)
+    months = max(int(years * 12), 1)
+    password = auth.hash_password_sync("bench")
+
+    with engine.begin() as connection:
+        clear(connection)
+
+        for user_number in range(users):
+            user_id = connection.execute(
+                insert(UserDb).returning(UserDb.id),
+                {"login": f"{LOGIN_PREFIX}{user_number}", "password": password}
+            ).scalar()
+            connection.execute(
+                insert(SettingsDb),
+                {"start_date": utils.get_current_period()[0], "base_currency": Currency.EUR.value, "user_id": user_id}
+            )
+
+            income_ids = create_categories(
+                connection, user_id, [f"income-{n}" for n in range(incomes)], CategoryType.INCOME
+            )
+            account_ids = create_categories(
+                connection, user_id, [f"account-{n}" for n in range(accounts)], CategoryType.ACCOUNT
+            )
+            expense_ids = create_categories(
+                connection, user_id, [f"expense-{n}" for n in range(expenses)], CategoryType.EXPENSE
+            )
+            deletable_ids = create_categories(
+                connection, user_id, [f"{DELETABLE_PREFIX}{n}" for n in range(deletable)], CategoryType.EXPENSE
+            )
+
+            rows = generate_transactions(
+                generator,
+                user_id,
+                income_ids,
+                account_ids,
+                expense_ids + deletable_ids,
+                months,
+                transactions_per_month
+            )
+            balances = {}
+            for row in rows:
+                balances[row["source"]] = balances.get(row["source"], 0) - row["amount"]
+                balances[row["destination"]] = balances.get(row["destination"], 0) + row["amount"]
+            for chunk_start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                connection.execute(insert(TransactionDb), rows[chunk_start:chunk_start + INSERT_CHUNK_SIZE])
+            for category_id, amount in balances.items():
+                connection.execute(update(CategoryDb).where(CategoryDb.id == category_id).values(amount=amount))
+
+            connection.execute(
+                insert(CategoryPeriodTotalDb).from_select(
+                    ["category_id", "month", "amount"],
+                    database_crud.select_category_period_totals_from_transactions(user_id)
+                )
+            )
+
+        return get_bench_user_ids(connection)
+
+
+def add_seed_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--incomes", type=int, default=3, help="income categories per user")
+    parser.add_argument("--accounts", type=int, default=5, help="account categories per user")
+    parser.add_argument("--expenses", type=int, default=40, help="expense categories per user")
+    parser.add_argument("--deletable", type=int, default=5, help="extra expense categories per user for deletes")
+    parser.add_argument("--years", type=float, default=3, help="history length per user")
+    parser.add_argument("--transactions-per-month", type=int, default=300)
+    parser.add_argument("--random-seed", type=int, default=0)
+
+
+def seed_from_arguments(args: argparse.Namespace) -> list[int]:
+    return seed(
+        users=args.users,
+        incomes=args.incomes,
+        accounts=args.accounts,
+        expenses=args.expenses,
+        deletable=args.deletable,
+        years=args.years,
+        transactions_per_month=args.transactions_per_month,
+        random_seed=args.random_seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="seed the configured database with synthetic benchmark users")
+    add_seed_arguments(parser)
+    user_ids = seed_from_arguments(parser.parse_args())
+    print(f"seeded {len(user_ids)} users")
+
+
+if __name__ == "__main__":
+    main()
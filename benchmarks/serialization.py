@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import serialization
+from benchmarks import seed
+from database import engine
+from database_crud import TRANSACTION_COLUMNS
+from database_models import TransactionDb
+from models import Transaction
+
+
+def get_orm_body(connection, user_id: int, rows: int, field, loop: asyncio.AbstractEventLoop) -> bytes:
+    with Session(bind=connection) as session:
+        transactions = session.execute(
+            select(TransactionDb).where(TransactionDb.user_id == user_id).order_by(TransactionDb.id).limit(rows)
+        ).scalars().all()
+        content = loop.run_until_complete(serialize_response(field=field, response_content=transactions))
+    return JSONResponse(content).body
+
+
+def get_fast_body(connection, user_id: int, rows: int) -> bytes:
+    transactions = connection.execute(
+        select(*TRANSACTION_COLUMNS).where(TransactionDb.user_id == user_id).order_by(TransactionDb.id).limit(rows)
+    ).all()
+    return serialization.FastJSONResponse(serialization.rows_to_dicts(transactions)).body
+
+
+def measure(run, repeat: int) -> dict:
+    body = run()
+    rows = len(json.loads(body))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    duration = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "bytes": len(body),
+        "mean_ms": round(duration / repeat * 1000, 3),
+        "rows_per_second": round(rows * repeat / duration, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare rows/sec of the ORM + pydantic and column tuple list paths")
+    seed.add_seed_arguments(parser)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse previously seeded benchmark users")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.skip_seed:
+        with engine.connect() as connection:
+            user_ids = seed.get_bench_user_ids(connection)
+    else:
+        user_ids = seed.seed_from_arguments(args)
+
+    field = create_response_field(name="Response_get_category_transactions", type_=list[Transaction])
+    loop = asyncio.new_event_loop()
+    report = {"results": []}
+    with engine.connect() as connection:
+        for rows in args.rows:
+            orm = measure(lambda: get_orm_body(connection, user_ids[0], rows, field, loop), args.repeat)
+            fast = measure(lambda: get_fast_body(connection, user_ids[0], rows), args.repeat)
+            report["results"].append({
+                "orm": orm,
+                "fast": fast,
+                "speedup": round(fast["rows_per_second"] / orm["rows_per_second"], 2)
+            })
+    loop.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,114 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
+import instrumentation
+import metrics
 from app_settings import AppSettings
 
+
+def get_async_database_url(database_url: str) -> URL:
+    url = make_url(database_url)
+    if url.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        url = url.set(drivername="postgresql+asyncpg")
+    return url
+
+
+class TimedQueuePool(QueuePool):
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            instrumentation.db_pool_checkout_seconds.observe(time.perf_counter() - started)
+
+
+class TimedAsyncAdaptedQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    pass
+
+
+def get_server_settings() -> dict:
+    server_settings = {"timezone": "utc"}
+    if AppSettings().db_statement_timeout_ms is not None:
+        server_settings["statement_timeout"] = str(AppSettings().db_statement_timeout_ms)
+    return server_settings
+
+
+def get_async_connect_args() -> dict:
+    connect_args = {"server_settings": get_server_settings()}
+    if AppSettings().db_pgbouncer:
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_cache_size"] = 0
+    return connect_args
+
+
+def get_pool_args() -> dict:
+    settings = AppSettings()
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_seconds
+    }
+
+
 DATABASE_URL = AppSettings().database_url
-engine = create_engine(DATABASE_URL, connect_args={"options": "-c timezone=utc"})
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=TimedQueuePool,
+    connect_args={"options": " ".join(f"-c {key}={value}" for key, value in get_server_settings().items())},
+    **get_pool_args()
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    get_async_database_url(DATABASE_URL),
+    poolclass=TimedAsyncAdaptedQueuePool,
+    isolation_level=AppSettings().db_isolation_level,
+    connect_args=get_async_connect_args(),
+    **get_pool_args()
+)
+AsyncSessionLocal = sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - connection.info["query_started"].pop()
+    instrumentation.record_statement(statement, parameters, seconds, instrumentation.get_cursor_rows(cursor))
+
+
+def handle_error(exception_context):
+    if exception_context.connection is not None and exception_context.connection.info.get("query_started"):
+        exception_context.connection.info["query_started"].pop()
+
+
+for instrumented_engine in (engine, async_engine.sync_engine):
+    event.listen(instrumented_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(instrumented_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(instrumented_engine, "handle_error", handle_error)
+
+metrics.FunctionMetric(
+    "db_pool_checked_out", "connections currently checked out of the async pool", "gauge",
+    lambda: async_engine.pool.checkedout()
+)
+metrics.FunctionMetric(
+    "db_pool_overflow", "connections open beyond db_pool_size", "gauge",
+    lambda: max(async_engine.pool.overflow(), 0)
+)
+
 Base = declarative_base()
@@ -1,214 +1,868 @@
+import asyncio
+import random
 from datetime import datetime, date
-
-from sqlalchemy.orm import Session
+from decimal import Decimal
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar
+
+from sqlalchemy import select, update, delete, union_all, and_, or_, cast, tuple_, true, literal_column, values, \
+    column, Date
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import func
 
-from database_models import UserDb, CategoryDb, TransactionDb, SettingsDb
+import events
+import metrics
+import period_cache
+import utils
+from database_models import UserDb, CategoryDb, TransactionDb, SettingsDb, CategoryPeriodTotalDb, FxRateDb, \
+    IdempotencyKeyDb, ChangeDb
 from models import UserCreate, CategoryType, CategoryCreate, TransactionCreate, CategoryUpdate, TransactionUpdate, \
-    SettingsCreate, SettingsUpdate, Currency
+    SettingsCreate, SettingsUpdate, Currency, SyncEntity
+from app_settings import AppSettings
+
+T = TypeVar("T")
+
+# serialization_failure and deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+WRITE_RETRY_ATTEMPTS = AppSettings().db_write_retry_attempts
+WRITE_RETRY_BASE_DELAY_SECONDS = 0.02
+
+write_retries = metrics.Counter("db_write_retries_total", "writes retried after a serialization failure or deadlock")
+write_retries_exhausted = metrics.Counter(
+    "db_write_retries_exhausted_total", "writes given up after running out of retries"
+)
 
+# column tuples for list endpoints, in response field order, so rows skip ORM identity-map hydration
+USER_COLUMNS = (UserDb.login, UserDb.id)
+CATEGORY_COLUMNS = (
+    CategoryDb.name, CategoryDb.type, CategoryDb.amount, CategoryDb.currency, CategoryDb.id, CategoryDb.user_id
+)
+TRANSACTION_COLUMNS = (
+    TransactionDb.amount, TransactionDb.source, TransactionDb.destination, TransactionDb.timestamp, TransactionDb.id,
+    TransactionDb.user_id
+)
+SETTINGS_COLUMNS = (SettingsDb.start_date, SettingsDb.base_currency, SettingsDb.id)
 
-def get_users(db: Session, offset: int = 0, limit: int = 100) -> list[UserDb]:
-    return db.query(UserDb).offset(offset).limit(limit).all()
+CHANGE_INSERT_CHUNK_SIZE = 5000
+PERIOD_TOTAL_UPSERT_CHUNK_SIZE = 5000
 
 
-def get_user(db: Session, user_id: int) -> UserDb:
-    return db.query(UserDb).filter(UserDb.id == user_id).first()
+async def get_users(db: AsyncSession, offset: int = 0, limit: int = 100) -> list[Row]:
+    result = await db.execute(select(*USER_COLUMNS).order_by(UserDb.id).offset(offset).limit(limit))
+    return result.all()
 
 
-def get_user_by_login(db: Session, login: str) -> UserDb:
-    return db.query(UserDb).filter(UserDb.login == login).first()
+async def get_user(db: AsyncSession, user_id: int) -> UserDb:
+    result = await db.execute(select(UserDb).where(UserDb.id == user_id))
+    return result.scalars().first()
 
 
-def create_user(db: Session, user_create: UserCreate) -> UserDb:
+async def get_user_by_login(db: AsyncSession, login: str) -> UserDb:
+    result = await db.execute(select(UserDb).where(UserDb.login == login))
+    return result.scalars().first()
+
+
+async def create_user(db: AsyncSession, user_create: UserCreate) -> UserDb:
     fake_hashed_password = user_create.password
     db_user = UserDb(login=user_create.login, password=fake_hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
-    settings_create = SettingsCreate(start_date=datetime.utcnow(), base_currency=Currency.EUR.value)
+    settings_create = SettingsCreate(start_date=utils.get_current_period()[0], base_currency=Currency.EUR.value)
     db_settings = SettingsDb(**settings_create.dict(), user_id=db_user.id)
     db.add(db_settings)
 
-    db.commit()
+    await db.commit()
     return db_user
 
 
-def get_user_settings(db: Session, user_id: int) -> SettingsDb:
-    return db.query(SettingsDb).filter(SettingsDb.user_id == user_id).first()
-
+async def get_versioned_settings(db: AsyncSession, user_id: int) -> Optional[Row]:
+    # the ETag and the period math of one request must agree, so both read this row once per session
+    versioned_settings = db.info.setdefault("versioned_settings", {})
+    if user_id not in versioned_settings:
+        result = await db.execute(
+            select(UserDb.data_version, SettingsDb.start_date, SettingsDb.base_currency)
+            .join(SettingsDb, SettingsDb.user_id == UserDb.id)
+            .where(UserDb.id == user_id)
+        )
+        versioned_settings[user_id] = result.first()
+    return versioned_settings[user_id]
 
-def update_user_settings(db: Session, settings_update: SettingsUpdate, user_id: int) -> SettingsDb:
-    db.query(SettingsDb).filter(SettingsDb.user_id == user_id).update(settings_update.dict(exclude_none=True))
-    db.commit()
-    return db.query(SettingsDb).filter(SettingsDb.user_id == user_id).first()
 
+async def get_data_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    versioned_settings = await get_versioned_settings(db, user_id)
+    return None if versioned_settings is None else versioned_settings.data_version
 
-def get_incomes(db: Session, user_id: int, offset: int = 0, limit: int = 100) -> list[CategoryDb]:
-    return db.query(CategoryDb) \
-        .filter(CategoryDb.user_id == user_id) \
-        .filter(CategoryDb.type == CategoryType.INCOME.value) \
-        .offset(offset).limit(limit).all()
 
+async def get_user_settings(db: AsyncSession, user_id: int) -> SettingsDb:
+    result = await db.execute(select(SettingsDb).where(SettingsDb.user_id == user_id))
+    return result.scalars().first()
 
-def get_accounts(db: Session, user_id: int, offset: int = 0, limit: int = 100) -> list[CategoryDb]:
-    return db.query(CategoryDb) \
-        .filter(CategoryDb.user_id == user_id) \
-        .filter(CategoryDb.type == CategoryType.ACCOUNT.value) \
-        .offset(offset).limit(limit).all()
 
+async def update_user_settings(db: AsyncSession, settings_update: SettingsUpdate, user_id: int) -> SettingsDb:
+    result = await db.execute(
+        update(SettingsDb)
+        .where(SettingsDb.user_id == user_id)
+        .values(**settings_update.dict(exclude_none=True))
+        .returning(SettingsDb.id)
+    )
+    record_changes(db, user_id, SyncEntity.SETTINGS, result.scalars().all())
+    await commit_and_invalidate(db)
+    return await get_user_settings(db, user_id)
 
-def get_expenses(db: Session, user_id: int, offset: int = 0, limit: int = 100) -> list[CategoryDb]:
-    return db.query(CategoryDb) \
-        .filter(CategoryDb.user_id == user_id) \
-        .filter(CategoryDb.type == CategoryType.EXPENSE.value) \
-        .offset(offset).limit(limit).all()
 
+async def get_categories_by_type(
+        db: AsyncSession,
+        user_id: int,
+        category_type: int,
+        offset: int = 0,
+        limit: int = 100
+) -> list[CategoryDb]:
+    result = await db.execute(
+        select(CategoryDb)
+        .where(CategoryDb.user_id == user_id)
+        .where(CategoryDb.type == category_type)
+        .offset(offset).limit(limit)
+    )
+    return result.scalars().all()
 
-def get_category_by_id(db: Session, category_id: int) -> CategoryDb:
-    return db.query(CategoryDb).filter(CategoryDb.id == category_id).first()
 
+async def get_category_rows_by_type(
+        db: AsyncSession,
+        user_id: int,
+        category_type: int,
+        offset: int = 0,
+        limit: int = 100
+) -> list[Row]:
+    result = await db.execute(
+        select(*CATEGORY_COLUMNS)
+        .where(CategoryDb.user_id == user_id)
+        .where(CategoryDb.type == category_type)
+        .offset(offset).limit(limit)
+    )
+    return result.all()
 
-def get_category_ids(db: Session, ids: list[int]) -> list[int]:
-    return list(map(lambda category: category.id, db.query(CategoryDb).filter(CategoryDb.id.in_(ids)).all()))
 
-
-def create_category(db: Session, category_create: CategoryCreate, user_id: int) -> CategoryDb:
-    db_category = CategoryDb(**category_create.dict(), user_id=user_id)
-    db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
-    return db_category
+async def get_incomes(db: AsyncSession, user_id: int, offset: int = 0, limit: int = 100) -> list[CategoryDb]:
+    return await get_categories_by_type(db, user_id, CategoryType.INCOME.value, offset, limit)
 
 
-def update_category(db: Session, category_update: CategoryUpdate, category_id: int) -> CategoryDb:
-    db.query(CategoryDb).filter(CategoryDb.id == category_id).update(category_update.dict(exclude_none=True))
-    db.commit()
+async def get_accounts(db: AsyncSession, user_id: int, offset: int = 0, limit: int = 100) -> list[CategoryDb]:
+    return await get_categories_by_type(db, user_id, CategoryType.ACCOUNT.value, offset, limit)
 
-    return db.query(CategoryDb).filter(CategoryDb.id == category_id).first()
 
+async def get_expenses(db: AsyncSession, user_id: int, offset: int = 0, limit: int = 100) -> list[CategoryDb]:
+    return await get_categories_by_type(db, user_id, CategoryType.EXPENSE.value, offset, limit)
 
-def delete_category(db: Session, category_id: int):
-    db.query(CategoryDb).filter(CategoryDb.id == category_id).delete()
-    transactions = get_category_transactions(db, category_id)
 
-    for transaction in transactions:
-        delete_transaction(db, transaction.id)
+async def get_user_categories(db: AsyncSession, user_id: int) -> list[CategoryDb]:
+    result = await db.execute(select(CategoryDb).where(CategoryDb.user_id == user_id).order_by(CategoryDb.id))
+    return result.scalars().all()
 
-    db.commit()
 
+async def get_category_by_id(db: AsyncSession, category_id: int) -> CategoryDb:
+    result = await db.execute(select(CategoryDb).where(CategoryDb.id == category_id))
+    return result.scalars().first()
 
-def get_transactions(db: Session, user_id: int, offset: int = 0, limit: int = 100) -> list[TransactionDb]:
-    return db.query(TransactionDb) \
-        .filter(TransactionDb.user_id == user_id) \
-        .offset(offset).limit(limit).all()
 
-
-def get_transaction_by_id(db: Session, transaction_id: int) -> TransactionDb:
-    return db.query(TransactionDb).filter(TransactionDb.id == transaction_id).first()
+async def create_category(
+        db: AsyncSession,
+        category_create: CategoryCreate,
+        user_id: int,
+        idempotency_key: IdempotencyKeyDb = None
+) -> CategoryDb:
+    db_category = CategoryDb(**category_create.dict(), user_id=user_id)
+    db.add(db_category)
+    await db.flush()
+    add_idempotency_key(db, idempotency_key, db_category.id)
+    record_changes(db, user_id, SyncEntity.CATEGORY, [db_category.id])
+    await commit_and_invalidate(db)
+    await db.refresh(db_category)
+    return db_category
 
 
-def get_category_transactions(
-        db: Session,
+async def update_category(db: AsyncSession, category_update: CategoryUpdate, category_id: int) -> CategoryDb:
+    result = await db.execute(
+        update(CategoryDb)
+        .where(CategoryDb.id == category_id)
+        .values(**category_update.dict(exclude_none=True))
+        .returning(CategoryDb.user_id)
+    )
+    record_changes(db, result.scalar(), SyncEntity.CATEGORY, [category_id])
+    await commit_and_invalidate(db)
+
+    return await db.get(CategoryDb, category_id)
+
+
+def select_category_counterparty_changes(category_id: int, transaction_filter):
+    outgoing = select(
+        TransactionDb.destination.label("category_id"),
+        (-TransactionDb.amount).label("balance_delta"),
+        TransactionDb.amount,
+        TransactionDb.timestamp
+    ).where(TransactionDb.source == category_id).where(transaction_filter)
+    incoming = select(
+        TransactionDb.source.label("category_id"),
+        TransactionDb.amount.label("balance_delta"),
+        TransactionDb.amount,
+        TransactionDb.timestamp
+    ).where(TransactionDb.destination == category_id).where(transaction_filter)
+    return union_all(outgoing, incoming).subquery()
+
+
+async def delete_category_transactions(
+        db: AsyncSession,
+        user_id: int,
         category_id: int,
-        period_start: date = None,
-        period_end: date = None
-) -> list[TransactionDb]:
-    source_transactions_query = db.query(TransactionDb).filter(TransactionDb.source == category_id)
-    if period_end is not None and period_start is not None:
-        source_transactions_query = source_transactions_query\
-            .filter(TransactionDb.timestamp >= period_start) \
-            .filter(TransactionDb.timestamp <= period_end)
-
-    destination_transactions_query = db.query(TransactionDb).filter(TransactionDb.destination == category_id)
-    if period_end is not None and period_start is not None:
-        destination_transactions_query = destination_transactions_query \
-            .filter(TransactionDb.timestamp >= period_start) \
-            .filter(TransactionDb.timestamp <= period_end)
-
-    source_transactions = source_transactions_query.all()
-    destination_transactions = destination_transactions_query.all()
-
-    output = [*source_transactions, *destination_transactions]
-    output.sort(key=lambda transaction: transaction.timestamp, reverse=True)
-    return output
-
-
-def get_category_period_sum(
-        db: Session,
+        transaction_filter=true()
+):
+    changes = select_category_counterparty_changes(category_id, transaction_filter)
+    # transactions before categories, the same order update_transaction and delete_transaction take their locks in
+    await db.execute(
+        select(TransactionDb.id)
+        .where(or_(TransactionDb.source == category_id, TransactionDb.destination == category_id))
+        .where(transaction_filter)
+        .order_by(TransactionDb.id)
+        .with_for_update()
+    )
+    await db.execute(
+        select(CategoryDb.id)
+        .where(CategoryDb.id.in_(select(changes.c.category_id)))
+        .order_by(CategoryDb.id)
+        .with_for_update()
+    )
+
+    balance_deltas = select(changes.c.category_id, func.sum(changes.c.balance_delta).label("delta")) \
+        .group_by(changes.c.category_id) \
+        .subquery()
+    result = await db.execute(
+        update(CategoryDb)
+        .where(CategoryDb.id == balance_deltas.c.category_id)
+        .values(amount=CategoryDb.amount + balance_deltas.c.delta)
+        .returning(CategoryDb.id, CategoryDb.amount)
+        .execution_options(synchronize_session=False)
+    )
+    record_balances(db, user_id, dict(result.all()))
+
+    month = truncate_to_month(changes.c.timestamp)
+    period_deltas = select(changes.c.category_id, month.label("month"), func.sum(changes.c.amount).label("amount")) \
+        .group_by(changes.c.category_id, month) \
+        .subquery()
+    await db.execute(
+        update(CategoryPeriodTotalDb)
+        .where(CategoryPeriodTotalDb.category_id == period_deltas.c.category_id)
+        .where(CategoryPeriodTotalDb.month == period_deltas.c.month)
+        .values(amount=CategoryPeriodTotalDb.amount - period_deltas.c.amount)
+        .execution_options(synchronize_session=False)
+    )
+
+    result = await db.execute(
+        delete(TransactionDb)
+        .where(or_(TransactionDb.source == category_id, TransactionDb.destination == category_id))
+        .where(transaction_filter)
+        .returning(TransactionDb.id)
+        .execution_options(synchronize_session=False)
+    )
+    record_changes(db, user_id, SyncEntity.TRANSACTION, result.scalars().all(), deleted=True)
+
+
+async def count_category_transactions(db: AsyncSession, category_id: int) -> int:
+    return await db.scalar(
+        select(func.count())
+        .select_from(TransactionDb)
+        .where(or_(TransactionDb.source == category_id, TransactionDb.destination == category_id))
+    )
+
+
+async def delete_category(
+        db: AsyncSession,
         category_id: int,
+        batch_size: int = None,
+        on_progress: Callable[[int], None] = None
+):
+    user_id = await db.scalar(select(CategoryDb.user_id).where(CategoryDb.id == category_id))
+    result = await db.execute(
+        select(CategoryDb.user_id, CategoryPeriodTotalDb.month)
+        .join(CategoryDb, CategoryDb.id == CategoryPeriodTotalDb.category_id)
+        .where(CategoryPeriodTotalDb.category_id == category_id)
+    )
+    stale_periods = result.all()
+
+    if batch_size is None:
+        await delete_category_transactions(db, user_id, category_id)
+    else:
+        while True:
+            result = await db.execute(
+                select(TransactionDb.id)
+                .where(or_(TransactionDb.source == category_id, TransactionDb.destination == category_id))
+                .limit(batch_size)
+            )
+            batch_ids = result.scalars().all()
+            if not batch_ids:
+                break
+
+            await delete_category_transactions(db, user_id, category_id, TransactionDb.id.in_(batch_ids))
+            mark_periods_stale(db, stale_periods)
+            await commit_and_invalidate(db)
+            if on_progress is not None:
+                on_progress(len(batch_ids))
+
+    await db.execute(delete(CategoryPeriodTotalDb).where(CategoryPeriodTotalDb.category_id == category_id))
+    await db.execute(delete(CategoryDb).where(CategoryDb.id == category_id))
+    record_changes(db, user_id, SyncEntity.CATEGORY, [category_id], deleted=True)
+    mark_periods_stale(db, stale_periods)
+    await commit_and_invalidate(db)
+
+
+async def get_transactions(db: AsyncSession, user_id: int, offset: int = 0, limit: int = 100) -> list[TransactionDb]:
+    result = await db.execute(
+        select(TransactionDb)
+        .where(TransactionDb.user_id == user_id)
+        .offset(offset).limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def stream_transactions(
+        db: AsyncSession,
+        user_id: int,
+        after: tuple[datetime, int] = None,
+        batch_size: int = 1000
+) -> AsyncIterator[TransactionDb]:
+    statement = select(TransactionDb) \
+        .where(TransactionDb.user_id == user_id) \
+        .order_by(TransactionDb.timestamp, TransactionDb.id)
+    if after is not None:
+        statement = statement.where(tuple_(TransactionDb.timestamp, TransactionDb.id) > tuple_(*after))
+
+    result = await db.stream(statement.execution_options(yield_per=batch_size))
+    async for transaction in result.scalars():
+        yield transaction
+
+
+async def get_transaction_by_id(db: AsyncSession, transaction_id: int) -> TransactionDb:
+    result = await db.execute(select(TransactionDb).where(TransactionDb.id == transaction_id))
+    return result.scalars().first()
+
+
+async def get_category_transactions_page(
+        db: AsyncSession,
+        category_id: int,
+        period_start: date = None,
+        period_end: date = None,
+        before: tuple[datetime, int] = None,
+        limit: int = 100
+) -> list[Row]:
+    side_pages = []
+    for side in (TransactionDb.source, TransactionDb.destination):
+        side_page = select(TransactionDb).where(side == category_id)
+        if period_end is not None and period_start is not None:
+            side_page = side_page \
+                .where(TransactionDb.timestamp >= period_start) \
+                .where(TransactionDb.timestamp < period_end)
+        if before is not None:
+            side_page = side_page.where(tuple_(TransactionDb.timestamp, TransactionDb.id) < tuple_(*before))
+        side_page = side_page.order_by(TransactionDb.timestamp.desc(), TransactionDb.id.desc()).limit(limit)
+        side_pages.append(select(side_page.subquery()))
+
+    page = union_all(*side_pages).subquery()
+    result = await db.execute(
+        select(*(page.c[column.key] for column in TRANSACTION_COLUMNS))
+        .order_by(page.c.timestamp.desc(), page.c.id.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+
+def select_period_calendar(periods: list[tuple[date, date]]):
+    return values(column("period_start", Date), column("period_end", Date), name="period_calendar").data(periods)
+
+
+def is_month_aligned(periods: list[tuple[date, date]]) -> bool:
+    return all(period_start.day == 1 and period_end.day == 1 for period_start, period_end in periods)
+
+
+async def get_categories_calendar_sums(
+        db: AsyncSession,
+        user_id: int,
+        category_type: int,
+        periods: list[tuple[date, date]]
+) -> dict[date, dict[int, Decimal]]:
+    calendar = select_period_calendar(periods)
+    if is_month_aligned(periods):
+        statement = select(
+            calendar.c.period_start, CategoryPeriodTotalDb.category_id, func.sum(CategoryPeriodTotalDb.amount)
+        ) \
+            .join(CategoryDb, CategoryDb.id == CategoryPeriodTotalDb.category_id) \
+            .join(calendar, and_(
+                CategoryPeriodTotalDb.month >= calendar.c.period_start,
+                CategoryPeriodTotalDb.month < calendar.c.period_end
+            )) \
+            .group_by(calendar.c.period_start, CategoryPeriodTotalDb.category_id)
+    else:
+        sides = select_category_transaction_sides(
+            user_id,
+            min(period_start for period_start, _ in periods),
+            max(period_end for _, period_end in periods)
+        )
+        statement = select(calendar.c.period_start, sides.c.category_id, func.sum(sides.c.amount)) \
+            .join(CategoryDb, CategoryDb.id == sides.c.category_id) \
+            .join(calendar, and_(
+                sides.c.timestamp >= calendar.c.period_start,
+                sides.c.timestamp < calendar.c.period_end
+            )) \
+            .group_by(calendar.c.period_start, sides.c.category_id)
+    result = await db.execute(
+        statement.where(CategoryDb.user_id == user_id).where(CategoryDb.type == category_type)
+    )
+
+    sums = {}
+    for period_start, category_id, amount in result.all():
+        sums.setdefault(period_start, {})[category_id] = amount
+    return sums
+
+
+async def get_categories_calendar_period_sums(
+        db: AsyncSession,
+        user_id: int,
+        category_type: int,
+        periods: list[tuple[date, date]]
+) -> dict[date, dict[int, Decimal]]:
+    return await period_cache.get_or_load(
+        user_id,
+        category_type,
+        periods,
+        lambda missing: get_categories_calendar_sums(db, user_id, category_type, missing)
+    )
+
+
+async def get_categories_period_sums(
+        db: AsyncSession,
+        user_id: int,
+        category_type: int,
         period_start: date,
         period_end: date
-) -> float:
-    source_transactions_sum = db.query(func.sum(TransactionDb.amount))\
-        .filter(TransactionDb.source == category_id) \
-        .filter(TransactionDb.timestamp >= period_start) \
-        .filter(TransactionDb.timestamp <= period_end).scalar()
-
-    destination_transactions_sum = db.query(func.sum(TransactionDb.amount)) \
-        .filter(TransactionDb.destination == category_id) \
-        .filter(TransactionDb.timestamp >= period_start) \
-        .filter(TransactionDb.timestamp <= period_end).scalar()
-
-    source_transactions_sum = 0 if source_transactions_sum is None else source_transactions_sum
-    destination_transactions_sum = 0 if destination_transactions_sum is None else destination_transactions_sum
-
-    return source_transactions_sum + destination_transactions_sum
-
-
-def create_transaction(db: Session, transaction_create: TransactionCreate, user_id: int) -> TransactionDb:
+) -> dict[int, Decimal]:
+    sums = await get_categories_calendar_period_sums(db, user_id, category_type, [(period_start, period_end)])
+    return sums.get(period_start, {})
+
+
+def mark_user_changed(db: AsyncSession, user_id: int):
+    db.info.setdefault("changed_users", set()).add(user_id)
+
+
+def mark_periods_stale(db: AsyncSession, periods: Iterable[tuple[int, date]]):
+    periods = {tuple(period) for period in periods}
+    db.info.setdefault("stale_periods", set()).update(periods)
+    db.info.setdefault("changed_users", set()).update(user_id for user_id, _ in periods)
+
+
+def record_changes(
+        db: AsyncSession,
+        user_id: int,
+        entity: SyncEntity,
+        entity_ids: Iterable[int],
+        deleted: bool = False
+):
+    changes = db.info.setdefault("changes", {})
+    for entity_id in entity_ids:
+        changes[(user_id, entity.value, entity_id)] = deleted
+    mark_user_changed(db, user_id)
+
+
+def record_balances(db: AsyncSession, user_id: int, balances: dict[int, Decimal]):
+    db.info.setdefault("balances", {}).setdefault(user_id, {}).update(balances)
+    record_changes(db, user_id, SyncEntity.CATEGORY, balances)
+
+
+def discard_pending_changes(db: AsyncSession):
+    for key in ("stale_periods", "changed_users", "changes", "balances"):
+        db.info.pop(key, None)
+
+
+async def bump_data_versions(
+        db: AsyncSession,
+        user_ids: set[int],
+        changes: dict[tuple[int, str, int], bool]
+) -> dict[int, int]:
+    versions = {}
+    for user_id in sorted(user_ids):
+        change_seq = await db.scalar(
+            update(UserDb)
+            .where(UserDb.id == user_id)
+            .values(data_version=UserDb.data_version + 1)
+            .returning(UserDb.data_version)
+        )
+        versions[user_id] = change_seq
+        rows = [
+            {"user_id": user_id, "change_seq": change_seq, "entity": entity, "entity_id": entity_id, "deleted": deleted}
+            for (change_user_id, entity, entity_id), deleted in sorted(changes.items())
+            if change_user_id == user_id
+        ]
+        for chunk_start in range(0, len(rows), CHANGE_INSERT_CHUNK_SIZE):
+            await db.execute(insert(ChangeDb).values(rows[chunk_start:chunk_start + CHANGE_INSERT_CHUNK_SIZE]))
+    return versions
+
+
+async def get_change_seqs(db: AsyncSession, user_id: int, after: int, limit: int) -> list[int]:
+    result = await db.execute(
+        select(ChangeDb.change_seq)
+        .where(ChangeDb.user_id == user_id)
+        .where(ChangeDb.change_seq > after)
+        .group_by(ChangeDb.change_seq)
+        .order_by(ChangeDb.change_seq)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def get_changes(db: AsyncSession, user_id: int, after: int, up_to: int) -> list[Row]:
+    result = await db.execute(
+        select(ChangeDb.entity, ChangeDb.entity_id, ChangeDb.deleted)
+        .where(ChangeDb.user_id == user_id)
+        .where(ChangeDb.change_seq > after)
+        .where(ChangeDb.change_seq <= up_to)
+        .order_by(ChangeDb.change_seq, ChangeDb.id)
+    )
+    return result.all()
+
+
+async def get_category_rows_by_ids(db: AsyncSession, user_id: int, category_ids: list[int]) -> list[Row]:
+    if not category_ids:
+        return []
+    result = await db.execute(
+        select(*CATEGORY_COLUMNS)
+        .where(CategoryDb.user_id == user_id)
+        .where(CategoryDb.id.in_(category_ids))
+        .order_by(CategoryDb.id)
+    )
+    return result.all()
+
+
+async def get_transaction_rows_by_ids(db: AsyncSession, user_id: int, transaction_ids: list[int]) -> list[Row]:
+    if not transaction_ids:
+        return []
+    result = await db.execute(
+        select(*TRANSACTION_COLUMNS)
+        .where(TransactionDb.user_id == user_id)
+        .where(TransactionDb.id.in_(transaction_ids))
+        .order_by(TransactionDb.id)
+    )
+    return result.all()
+
+
+async def get_settings_rows(db: AsyncSession, user_id: int) -> list[Row]:
+    result = await db.execute(select(*SETTINGS_COLUMNS).where(SettingsDb.user_id == user_id))
+    return result.all()
+
+
+async def commit_and_invalidate(db: AsyncSession):
+    versions = await bump_data_versions(db, db.info.pop("changed_users", set()), db.info.pop("changes", {}))
+    balance_events = events.build_balance_events(db.info.pop("balances", {}), versions)
+    await events.backend.before_commit(db, balance_events)
+    await db.commit()
+    db.info.pop("versioned_settings", None)
+    events.backend.after_commit(balance_events)
+    stale_periods = db.info.pop("stale_periods", None)
+    if stale_periods:
+        await period_cache.invalidate(stale_periods)
+
+
+async def update_category_period_totals(
+        db: AsyncSession,
+        user_id: int,
+        changes: list[tuple[int, datetime, Decimal]]
+):
+    deltas = {}
+    for category_id, timestamp, amount in changes:
+        key = (category_id, utils.get_month_start(timestamp))
+        deltas[key] = deltas.get(key, 0) + amount
+    mark_periods_stale(db, {(user_id, month) for _, month in deltas})
+
+    rows = [
+        {"category_id": category_id, "month": month, "amount": amount}
+        for (category_id, month), amount in sorted(deltas.items())
+    ]
+    # asyncpg allows at most 32767 bind parameters per statement
+    for chunk_start in range(0, len(rows), PERIOD_TOTAL_UPSERT_CHUNK_SIZE):
+        statement = insert(CategoryPeriodTotalDb).values(rows[chunk_start:chunk_start + PERIOD_TOTAL_UPSERT_CHUNK_SIZE])
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[CategoryPeriodTotalDb.category_id, CategoryPeriodTotalDb.month],
+            set_={"amount": CategoryPeriodTotalDb.amount + statement.excluded.amount}
+        ))
+
+
+def truncate_to_month(timestamp):
+    # a literal keeps the expression identical between SELECT and GROUP BY under asyncpg's numbered params
+    return cast(func.date_trunc(literal_column("'month'"), timestamp), Date)
+
+
+def select_category_transaction_sides(user_id: int = None, period_start: date = None, period_end: date = None):
+    source_side = select(
+        TransactionDb.source.label("category_id"), TransactionDb.timestamp, TransactionDb.amount
+    )
+    destination_side = select(
+        TransactionDb.destination.label("category_id"), TransactionDb.timestamp, TransactionDb.amount
+    )
+    if user_id is not None:
+        source_side = source_side.where(TransactionDb.user_id == user_id)
+        destination_side = destination_side.where(TransactionDb.user_id == user_id)
+    if period_start is not None and period_end is not None:
+        source_side = source_side \
+            .where(TransactionDb.timestamp >= period_start) \
+            .where(TransactionDb.timestamp < period_end)
+        destination_side = destination_side \
+            .where(TransactionDb.timestamp >= period_start) \
+            .where(TransactionDb.timestamp < period_end)
+
+    return union_all(source_side, destination_side).subquery()
+
+
+def select_category_period_totals_from_transactions(user_id: int = None):
+    sides = select_category_transaction_sides(user_id)
+    month = truncate_to_month(sides.c.timestamp)
+    return select(sides.c.category_id, month.label("month"), func.sum(sides.c.amount).label("amount")) \
+        .group_by(sides.c.category_id, month)
+
+
+def select_stored_category_period_totals(user_id: int = None):
+    statement = select(CategoryPeriodTotalDb.category_id, CategoryPeriodTotalDb.month, CategoryPeriodTotalDb.amount)
+    if user_id is not None:
+        statement = statement.where(
+            CategoryPeriodTotalDb.category_id.in_(select(CategoryDb.id).where(CategoryDb.user_id == user_id))
+        )
+    return statement
+
+
+async def get_category_period_totals_drift(db: AsyncSession, user_id: int = None) -> list[tuple]:
+    expected = select_category_period_totals_from_transactions(user_id).subquery()
+    stored = select_stored_category_period_totals(user_id).subquery()
+    result = await db.execute(
+        select(
+            func.coalesce(expected.c.category_id, stored.c.category_id),
+            func.coalesce(expected.c.month, stored.c.month),
+            stored.c.amount,
+            expected.c.amount
+        )
+        .select_from(expected.join(
+            stored,
+            and_(expected.c.category_id == stored.c.category_id, expected.c.month == stored.c.month),
+            full=True
+        ))
+        .where(func.coalesce(stored.c.amount, 0) != func.coalesce(expected.c.amount, 0))
+    )
+    return result.all()
+
+
+async def rebuild_category_period_totals(db: AsyncSession, user_id: int = None):
+    stale_periods = select(CategoryDb.user_id, CategoryPeriodTotalDb.month) \
+        .join(CategoryDb, CategoryDb.id == CategoryPeriodTotalDb.category_id) \
+        .distinct()
+    statement = delete(CategoryPeriodTotalDb)
+    if user_id is not None:
+        stale_periods = stale_periods.where(CategoryDb.user_id == user_id)
+        statement = statement.where(
+            CategoryPeriodTotalDb.category_id.in_(select(CategoryDb.id).where(CategoryDb.user_id == user_id))
+        )
+    mark_periods_stale(db, (await db.execute(stale_periods)).all())
+    await db.execute(statement)
+    await db.execute(
+        insert(CategoryPeriodTotalDb).from_select(
+            ["category_id", "month", "amount"],
+            select_category_period_totals_from_transactions(user_id)
+        )
+    )
+    mark_periods_stale(db, (await db.execute(stale_periods)).all())
+    await commit_and_invalidate(db)
+
+
+async def get_fx_rates(db: AsyncSession) -> list[tuple[int, date, Decimal]]:
+    result = await db.execute(select(FxRateDb.currency, FxRateDb.day, FxRateDb.rate))
+    return result.all()
+
+
+async def upsert_fx_rates(db: AsyncSession, rates: list[tuple[int, date, Decimal]], chunk_size: int = 1000):
+    for chunk_start in range(0, len(rates), chunk_size):
+        statement = insert(FxRateDb).values([
+            {"currency": currency, "day": day, "rate": rate}
+            for currency, day, rate in rates[chunk_start:chunk_start + chunk_size]
+        ])
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[FxRateDb.currency, FxRateDb.day],
+            set_={"rate": statement.excluded.rate}
+        ))
+    await db.commit()
+
+
+async def apply_balance_deltas(db: AsyncSession, user_id: int, balance_deltas: dict[int, Decimal]):
+    balances = {}
+    # ascending id order keeps concurrent writers from locking the same rows in opposite orders
+    for category_id in sorted(balance_deltas):
+        if balance_deltas[category_id] != 0:
+            balances[category_id] = await db.scalar(
+                update(CategoryDb)
+                .where(CategoryDb.id == category_id)
+                .values(amount=CategoryDb.amount + balance_deltas[category_id])
+                .returning(CategoryDb.amount)
+            )
+    record_balances(db, user_id, balances)
+
+
+def add_transfer(balance_deltas: dict[int, Decimal], source: int, destination: int, amount: Decimal):
+    balance_deltas[source] = balance_deltas.get(source, 0) - amount
+    balance_deltas[destination] = balance_deltas.get(destination, 0) + amount
+
+
+async def get_transaction_for_update(db: AsyncSession, transaction_id: int) -> TransactionDb:
+    result = await db.execute(
+        select(TransactionDb)
+        .where(TransactionDb.id == transaction_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+
+async def get_idempotency_key(db: AsyncSession, user_id: int, key: str) -> IdempotencyKeyDb:
+    return await db.get(IdempotencyKeyDb, (user_id, key))
+
+
+def add_idempotency_key(db: AsyncSession, idempotency_key: Optional[IdempotencyKeyDb], resource_id: int):
+    if idempotency_key is not None:
+        idempotency_key.resource_id = resource_id
+        db.add(idempotency_key)
+
+
+async def create_transaction(
+        db: AsyncSession,
+        transaction_create: TransactionCreate,
+        user_id: int,
+        idempotency_key: IdempotencyKeyDb = None
+) -> TransactionDb:
     db_transaction = TransactionDb(**transaction_create.dict(), user_id=user_id)
     db.add(db_transaction)
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == transaction_create.source) \
-        .update({"amount": CategoryDb.amount - transaction_create.amount})
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == transaction_create.destination) \
-        .update({"amount": CategoryDb.amount + transaction_create.amount})
-
-    db.commit()
-    db.refresh(db_transaction)
-
-    return db_transaction
+    await db.flush()
 
+    balance_deltas = {}
+    add_transfer(balance_deltas, transaction_create.source, transaction_create.destination, transaction_create.amount)
+    await apply_balance_deltas(db, user_id, balance_deltas)
+    await update_category_period_totals(db, user_id, [
+        (transaction_create.source, transaction_create.timestamp, transaction_create.amount),
+        (transaction_create.destination, transaction_create.timestamp, transaction_create.amount)
+    ])
+    add_idempotency_key(db, idempotency_key, db_transaction.id)
+    record_changes(db, user_id, SyncEntity.TRANSACTION, [db_transaction.id])
 
-def update_transaction(db: Session, transaction_update: TransactionUpdate, transaction_id: int) -> TransactionDb:
-    db_transaction = db.query(TransactionDb).filter(TransactionDb.id == transaction_id).first()
+    await commit_and_invalidate(db)
+    await db.refresh(db_transaction)
 
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == db_transaction.source) \
-        .update({"amount": CategoryDb.amount + db_transaction.amount})
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == transaction_update.source) \
-        .update({"amount": CategoryDb.amount - transaction_update.amount})
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == db_transaction.destination) \
-        .update({"amount": CategoryDb.amount - db_transaction.amount})
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == transaction_update.destination) \
-        .update({"amount": CategoryDb.amount + transaction_update.amount})
+    return db_transaction
 
-    db.query(TransactionDb).filter(TransactionDb.id == transaction_id)\
-        .update(transaction_update.dict(exclude_none=True))
 
-    db.commit()
-    db.refresh(db_transaction)
+async def create_transactions(
+        db: AsyncSession,
+        transaction_creates: list[TransactionCreate],
+        user_id: int,
+        chunk_size: int = 1000
+):
+    rows = [{**transaction_create.dict(), "user_id": user_id} for transaction_create in transaction_creates]
+    for chunk_start in range(0, len(rows), chunk_size):
+        result = await db.execute(
+            insert(TransactionDb).values(rows[chunk_start:chunk_start + chunk_size]).returning(TransactionDb.id)
+        )
+        record_changes(db, user_id, SyncEntity.TRANSACTION, result.scalars().all())
+
+    balance_deltas = {}
+    period_changes = []
+    for transaction_create in transaction_creates:
+        add_transfer(
+            balance_deltas, transaction_create.source, transaction_create.destination, transaction_create.amount
+        )
+        period_changes.append((transaction_create.source, transaction_create.timestamp, transaction_create.amount))
+        period_changes.append((transaction_create.destination, transaction_create.timestamp, transaction_create.amount))
+
+    await apply_balance_deltas(db, user_id, balance_deltas)
+    if period_changes:
+        await update_category_period_totals(db, user_id, period_changes)
+
+    await commit_and_invalidate(db)
+
+
+async def update_transaction(
+        db: AsyncSession,
+        transaction_update: TransactionUpdate,
+        transaction_id: int
+) -> TransactionDb:
+    db_transaction = await get_transaction_for_update(db, transaction_id)
+    old_source, old_destination = db_transaction.source, db_transaction.destination
+    old_amount, old_timestamp = db_transaction.amount, db_transaction.timestamp
+    changes = transaction_update.dict(exclude_none=True)
+    source = changes.get("source", old_source)
+    destination = changes.get("destination", old_destination)
+    amount = changes.get("amount", old_amount)
+    timestamp = changes.get("timestamp", old_timestamp)
+
+    balance_deltas = {}
+    add_transfer(balance_deltas, old_destination, old_source, old_amount)
+    add_transfer(balance_deltas, source, destination, amount)
+    await apply_balance_deltas(db, db_transaction.user_id, balance_deltas)
+
+    await db.execute(
+        update(TransactionDb)
+        .where(TransactionDb.id == transaction_id)
+        .values(**changes)
+    )
+    await update_category_period_totals(db, db_transaction.user_id, [
+        (old_source, old_timestamp, -old_amount),
+        (old_destination, old_timestamp, -old_amount),
+        (source, timestamp, amount),
+        (destination, timestamp, amount)
+    ])
+    record_changes(db, db_transaction.user_id, SyncEntity.TRANSACTION, [transaction_id])
+
+    await commit_and_invalidate(db)
+    await db.refresh(db_transaction)
 
     return db_transaction
 
 
-def delete_transaction(db: Session, transaction_id: int, commit: bool = True):
-    db_transaction = db.query(TransactionDb).filter(TransactionDb.id == transaction_id).first()
+async def delete_transaction(db: AsyncSession, transaction_id: int, commit: bool = True):
+    db_transaction = await get_transaction_for_update(db, transaction_id)
 
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == db_transaction.source) \
-        .update({"amount": CategoryDb.amount + db_transaction.amount})
-    db.query(CategoryDb) \
-        .filter(CategoryDb.id == db_transaction.destination) \
-        .update({"amount": CategoryDb.amount - db_transaction.amount})
+    balance_deltas = {}
+    add_transfer(balance_deltas, db_transaction.destination, db_transaction.source, db_transaction.amount)
+    await apply_balance_deltas(db, db_transaction.user_id, balance_deltas)
 
-    db.query(TransactionDb).filter(TransactionDb.id == transaction_id).delete()
+    await db.execute(delete(TransactionDb).where(TransactionDb.id == transaction_id))
+    await update_category_period_totals(db, db_transaction.user_id, [
+        (db_transaction.source, db_transaction.timestamp, -db_transaction.amount),
+        (db_transaction.destination, db_transaction.timestamp, -db_transaction.amount)
+    ])
+    record_changes(db, db_transaction.user_id, SyncEntity.TRANSACTION, [transaction_id], deleted=True)
 
     if commit:
-        db.commit()
+        await commit_and_invalidate(db)
+
+
+class WriteConflictError(Exception):
+    pass
+
+
+async def run_with_retry(db: AsyncSession, write: Callable[[], Awaitable[T]]) -> T:
+    for attempt in range(1, WRITE_RETRY_ATTEMPTS + 1):
+        try:
+            return await write()
+        except DBAPIError as error:
+            if getattr(error.orig, "pgcode", None) not in RETRYABLE_SQLSTATES:
+                raise
+            await db.rollback()
+            discard_pending_changes(db)
+            if attempt == WRITE_RETRY_ATTEMPTS:
+                write_retries_exhausted.inc()
+                raise WriteConflictError(f"write still conflicted after {WRITE_RETRY_ATTEMPTS} attempts") from error
+            write_retries.inc()
+            # full jitter spreads the retries of writers that conflicted on the same rows
+            await asyncio.sleep(random.uniform(0, WRITE_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
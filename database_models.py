@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Numeric, ForeignKey, DateTime, Date, Index, func
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -11,6 +11,7 @@ class UserDb(Base):
     id = Column(Integer, primary_key=True, index=True)
     login = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
+    data_version = Column(BigInteger, nullable=False, server_default="0")
 
     settings = relationship("SettingsDb", back_populates="user")
     categories = relationship("CategoryDb", back_populates="user")
@@ -30,11 +31,14 @@ class SettingsDb(Base):
 
 class CategoryDb(Base):
     __tablename__ = "categories"
+    __table_args__ = (
+        Index("ix_categories_user_id_type", "user_id", "type"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     type = Column(Integer, nullable=False)
-    amount = Column(Float, nullable=False)
+    amount = Column(Numeric(14, 2), nullable=False)
     currency = Column(Integer, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
 
@@ -43,12 +47,57 @@ class CategoryDb(Base):
 
 class TransactionDb(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_source_timestamp", "source", "timestamp"),
+        Index("ix_transactions_destination_timestamp", "destination", "timestamp"),
+        Index("ix_transactions_user_id_timestamp", "user_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    amount = Column(Float, nullable=False)
+    amount = Column(Numeric(14, 2), nullable=False)
     source = Column(Integer, nullable=False)
     destination = Column(Integer, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"))
     timestamp = Column(DateTime, nullable=False)
 
     user = relationship("UserDb", back_populates="transactions")
+
+
+class IdempotencyKeyDb(Base):
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    resource_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class FxRateDb(Base):
+    __tablename__ = "fx_rates"
+
+    currency = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    rate = Column(Numeric(18, 8), nullable=False)
+
+
+class CategoryPeriodTotalDb(Base):
+    __tablename__ = "category_period_totals"
+
+    category_id = Column(Integer, primary_key=True)
+    month = Column(Date, primary_key=True)
+    amount = Column(Numeric(14, 2), nullable=False)
+
+
+class ChangeDb(Base):
+    __tablename__ = "changes"
+    __table_args__ = (
+        Index("ix_changes_user_id_change_seq", "user_id", "change_seq"),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    change_seq = Column(BigInteger, nullable=False)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Optional
+
+import asyncpg
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import metrics
+import serialization
+from app_settings import AppSettings
+from database import DATABASE_URL, get_async_database_url
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "balance_changes"
+# postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_MAX_BYTES = 7900
+
+events_published = metrics.Counter("sse_events_published_total", "balance events queued for subscribers")
+subscribers_evicted = metrics.Counter(
+    "sse_subscribers_evicted_total", "subscribers dropped because their buffer was full"
+)
+
+
+class Subscriber:
+
+    def __init__(self, user_id: int, buffer_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[Optional[dict]] = asyncio.Queue(maxsize=buffer_size)
+
+
+class Broker:
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.subscribers: dict[int, set[Subscriber]] = {}
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        subscriber = Subscriber(user_id, self.buffer_size)
+        self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        user_subscribers = self.subscribers.get(subscriber.user_id, set())
+        user_subscribers.discard(subscriber)
+        if not user_subscribers:
+            self.subscribers.pop(subscriber.user_id, None)
+
+    def publish(self, user_id: int, event: dict):
+        for subscriber in list(self.subscribers.get(user_id, ())):
+            try:
+                subscriber.queue.put_nowait(event)
+                events_published.inc()
+            except asyncio.QueueFull:
+                self.evict(subscriber)
+
+    def evict(self, subscriber: Subscriber):
+        # a slow consumer loses its backlog and gets a sentinel telling it to resync from /changes
+        self.unsubscribe(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        subscribers_evicted.inc()
+
+    def evict_all(self):
+        for user_subscribers in list(self.subscribers.values()):
+            for subscriber in list(user_subscribers):
+                self.evict(subscriber)
+
+    def count(self) -> int:
+        return sum(len(user_subscribers) for user_subscribers in self.subscribers.values())
+
+
+broker = Broker(AppSettings().events_buffer_size)
+metrics.FunctionMetric("sse_subscribers", "open event stream connections", "gauge", broker.count)
+
+
+def build_balance_events(balances: dict[int, dict[int, Decimal]], versions: dict[int, int]) -> list[dict]:
+    return [
+        {
+            "user_id": user_id,
+            "version": versions.get(user_id),
+            "categories": [{"id": category_id, "amount": amount} for category_id, amount in sorted(amounts.items())]
+        }
+        for user_id, amounts in sorted(balances.items())
+    ]
+
+
+class MemoryBackend:
+
+    async def start(self):
+        pass
+
+    async def before_commit(self, db: AsyncSession, events: list[dict]):
+        pass
+
+    def after_commit(self, events: list[dict]):
+        for event in events:
+            broker.publish(event["user_id"], event)
+
+
+class PostgresBackend:
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.connection: asyncpg.Connection = None
+        self.lock: asyncio.Lock = None
+
+    async def start(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.connection is None or self.connection.is_closed():
+                self.connection = await asyncpg.connect(self.dsn)
+                self.connection.add_termination_listener(self.on_terminated)
+                await self.connection.add_listener(CHANNEL, self.on_notification)
+
+    def on_notification(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str):
+        event = serialization.loads(payload)
+        broker.publish(event["user_id"], event)
+
+    def on_terminated(self, connection: asyncpg.Connection):
+        # notifications sent while nobody listened are lost, so every subscriber has to resync
+        logger.warning("event listener connection closed")
+        self.connection = None
+        broker.evict_all()
+
+    async def before_commit(self, db: AsyncSession, events: list[dict]):
+        # NOTIFY is transactional: listeners only hear about writes that commit
+        for event in events:
+            payload = serialization.dumps(event)
+            if len(payload) > NOTIFY_PAYLOAD_MAX_BYTES:
+                payload = serialization.dumps({**event, "categories": None})
+            await db.execute(select(func.pg_notify(CHANNEL, payload.decode())))
+
+    def after_commit(self, events: list[dict]):
+        pass
+
+
+def create_backend():
+    if AppSettings().events_backend == "postgres":
+        url = get_async_database_url(DATABASE_URL).set(drivername="postgresql")
+        return PostgresBackend(url.render_as_string(hide_password=False))
+    return MemoryBackend()
+
+
+backend = create_backend()
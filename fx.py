@@ -0,0 +1,85 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database_crud
+import utils
+from app_settings import AppSettings
+from cache import TTLCache
+from models import Currency
+
+REFERENCE_CURRENCY = Currency.EUR.value
+
+rate_indexes = TTLCache(max_size=1, ttl_seconds=AppSettings().fx_rates_ttl_seconds)
+
+
+class RateIndex:
+
+    def __init__(self, rates: list[tuple[int, date, Decimal]]):
+        self.rates: dict[tuple[int, date], Decimal] = {}
+        self.ranges: dict[int, tuple[date, date]] = {}
+
+        points: dict[int, list[tuple[date, Decimal]]] = {}
+        for currency, day, rate in sorted(rates):
+            points.setdefault(currency, []).append((day, rate))
+
+        for currency, currency_points in points.items():
+            for (day, rate), (next_day, _) in zip(currency_points, currency_points[1:] + [(None, None)]):
+                self.rates[(currency, day)] = rate
+                if next_day is not None:
+                    for gap in range(1, (next_day - day).days):
+                        self.rates[(currency, day + timedelta(days=gap))] = rate
+            self.ranges[currency] = (currency_points[0][0], currency_points[-1][0])
+
+    def has_currency(self, currency: int) -> bool:
+        return currency == REFERENCE_CURRENCY or currency in self.ranges
+
+    def get_rate(self, currency: int, day: date) -> Optional[Decimal]:
+        if currency == REFERENCE_CURRENCY:
+            return Decimal(1)
+        if currency not in self.ranges:
+            return None
+        first_day, last_day = self.ranges[currency]
+        return self.rates[(currency, min(max(day, first_day), last_day))]
+
+    def get_factor(self, from_currency: int, to_currency: int, day: date) -> Optional[Decimal]:
+        if from_currency == to_currency:
+            return Decimal(1)
+        from_rate, to_rate = self.get_rate(from_currency, day), self.get_rate(to_currency, day)
+        return None if from_rate is None or to_rate is None else from_rate / to_rate
+
+
+async def get_rate_index(db: AsyncSession) -> RateIndex:
+    index = rate_indexes.get("rates")
+    if index is None:
+        index = RateIndex(await database_crud.get_fx_rates(db))
+        rate_indexes.set("rates", index)
+    return index
+
+
+def get_rate_day(period: tuple[date, date]) -> date:
+    return min(period[1] - timedelta(days=1), datetime.utcnow().date())
+
+
+def convert_period_sums(
+        index: RateIndex,
+        period_sums: dict[date, dict[int, Decimal]],
+        periods: list[tuple[date, date]],
+        category_currencies: dict[int, int],
+        base_currency: int
+) -> dict[date, dict[int, Decimal]]:
+    factors = {
+        (currency, period[0]): index.get_factor(currency, base_currency, get_rate_day(period))
+        for period in periods
+        for currency in set(category_currencies.values())
+    }
+    return {
+        period_start: {
+            category_id: utils.to_money(amount * factors[(category_currencies[category_id], period_start)])
+            for category_id, amount in sums.items()
+            if category_id in category_currencies
+        }
+        for period_start, sums in period_sums.items()
+    }
@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import csv
+from datetime import date
+from decimal import Decimal
+
+import database_crud
+from database import AsyncSessionLocal
+from models import Currency
+
+
+def parse_currency(value: str) -> int:
+    return int(value) if value.isdigit() else Currency[value.strip().upper()].value
+
+
+def read_rates(path: str) -> list[tuple[int, date, Decimal]]:
+    with open(path, newline="") as rates_file:
+        return [
+            (parse_currency(row["currency"]), date.fromisoformat(row["date"]), Decimal(row["rate"]))
+            for row in csv.DictReader(rates_file)
+        ]
+
+
+async def run(path: str) -> int:
+    rates = read_rates(path)
+    async with AsyncSessionLocal() as db:
+        await database_crud.upsert_fx_rates(db, rates)
+    return len(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="load daily exchange rates (date,currency,rate with rate in EUR per unit) into fx_rates"
+    )
+    parser.add_argument("path", help="csv file with date, currency and rate columns")
+    args = parser.parse_args()
+
+    print(f"loaded {asyncio.run(run(args.path))} rates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+import log_pipeline
+import metrics
+from app_settings import AppSettings
+
+slow_query_logger = logging.getLogger("slow_query")
+request_logger = logging.getLogger("request")
+
+SLOW_QUERY_MS = AppSettings().slow_query_ms
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+request_duration = metrics.Histogram("http_request_duration_seconds", "request latency by route")
+request_db_statements = metrics.Histogram(
+    "http_request_db_statements", "SQL statements executed per request", buckets=COUNT_BUCKETS
+)
+request_db_seconds = metrics.Histogram("http_request_db_seconds", "time spent in SQL per request")
+request_db_rows = metrics.Histogram("http_request_db_rows", "rows returned or affected per request", buckets=ROW_BUCKETS)
+db_statements = metrics.Counter("db_statements_total", "SQL statements executed")
+db_seconds = metrics.Counter("db_seconds_total", "time spent in SQL")
+db_pool_checkout_seconds = metrics.Histogram(
+    "db_pool_checkout_seconds", "time spent waiting for a pooled connection"
+)
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+
+def get_cursor_rows(cursor) -> int:
+    if cursor.rowcount >= 0:
+        return cursor.rowcount
+    # the asyncpg adapter only reports a rowcount for DML; SELECT rows are prefetched into _rows
+    return len(getattr(cursor, "_rows", None) or ())
+
+
+def record_statement(statement: str, parameters, seconds: float, rows: int):
+    db_statements.inc()
+    db_seconds.inc(seconds)
+
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += seconds
+        stats.rows += rows
+
+    if SLOW_QUERY_MS is not None and seconds * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning("slow query %.1f ms: %s params=%r", seconds * 1000, statement, parameters)
+
+
+def get_request_id(scope: dict) -> str:
+    for name, value in scope["headers"]:
+        if name == b"x-request-id":
+            return value.decode("latin-1")[:128]
+    return uuid.uuid4().hex
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+
+    def get_route_path(self, scope: dict) -> str:
+        if self.route_paths is None:
+            self.route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        request_id = get_request_id(scope)
+        context_token = log_pipeline.current_request_context.set(
+            log_pipeline.RequestContext(request_id, lambda: self.get_route_path(scope))
+        )
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            current_request_stats.reset(token)
+            route = self.get_route_path(scope)
+            request_duration.observe(duration, route=route, method=scope["method"], status=status["code"])
+            request_db_statements.observe(stats.statements, route=route)
+            request_db_seconds.observe(stats.db_seconds, route=route)
+            request_db_rows.observe(stats.rows, route=route)
+            request_logger.info("%s %s %s", scope["method"], route, status["code"], extra={
+                "method": scope["method"],
+                "status": status["code"],
+                "duration_ms": round(duration * 1000, 3),
+                "db_statements": stats.statements,
+                "db_ms": round(stats.db_seconds * 1000, 3)
+            })
+            log_pipeline.current_request_context.reset(context_token)
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+import uuid
+from typing import Awaitable, Callable
+
+from cache import TTLCache
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+jobs = TTLCache(max_size=1000, ttl_seconds=24 * 60 * 60)
+running_tasks: set[asyncio.Task] = set()
+
+
+def start_job(user_id: int, run: Callable[[Job], Awaitable[None]]) -> Job:
+    job = Job(id=uuid.uuid4().hex, user_id=user_id)
+    jobs.set(job.id, job)
+
+    task = asyncio.create_task(run_job(job, run))
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+    return job
+
+
+async def run_job(job: Job, run: Callable[[Job], Awaitable[None]]):
+    try:
+        await run(job)
+        job.status = "done"
+    except Exception as error:
+        logger.exception("job %s failed", job.id)
+        job.status = "failed"
+        job.detail = str(error)
+
+
+def get_job(job_id: str) -> Job:
+    return jobs.get(job_id)
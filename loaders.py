@@ -0,0 +1,43 @@
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database_models import CategoryDb
+
+
+class CategoryLoader:
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.categories: dict[int, Optional[CategoryDb]] = {}
+
+    async def load_many(self, ids: list[int]) -> dict[int, CategoryDb]:
+        missing_ids = {category_id for category_id in ids if category_id not in self.categories}
+        if missing_ids:
+            result = await self.db.execute(select(CategoryDb).where(CategoryDb.id.in_(missing_ids)))
+            found = {category.id: category for category in result.scalars()}
+            for category_id in missing_ids:
+                self.categories[category_id] = found.get(category_id)
+
+        return {
+            category_id: self.categories[category_id]
+            for category_id in ids
+            if self.categories[category_id] is not None
+        }
+
+    async def load(self, category_id: int) -> Optional[CategoryDb]:
+        return (await self.load_many([category_id])).get(category_id)
+
+    def prime(self, categories: list[CategoryDb]):
+        for category in categories:
+            self.categories[category.id] = category
+
+    def forget(self, category_id: int):
+        self.categories.pop(category_id, None)
+
+
+def get_category_loader(db: AsyncSession) -> CategoryLoader:
+    if "category_loader" not in db.info:
+        db.info["category_loader"] = CategoryLoader(db)
+    return db.info["category_loader"]
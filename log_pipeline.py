@@ -0,0 +1,155 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Callable, Optional
+
+import metrics
+from app_settings import AppSettings
+
+CONTEXT_FIELDS = ("request_id", "user_id", "route")
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+log_records_dropped = metrics.Counter("log_records_dropped_total", "log records dropped because the queue was full")
+log_records_sampled_out = metrics.Counter("log_records_sampled_out_total", "info log records skipped by sampling")
+
+queue_listener: Optional[QueueListener] = None
+metrics.FunctionMetric(
+    "log_queue_size", "log records waiting for the listener", "gauge",
+    lambda: 0 if queue_listener is None else queue_listener.queue.qsize()
+)
+
+
+class RequestContext:
+
+    def __init__(self, request_id: str, resolve_route: Callable[[], str]):
+        self.request_id = request_id
+        self.user_id: Optional[int] = None
+        self.resolve_route = resolve_route
+
+    @property
+    def route(self) -> str:
+        return self.resolve_route()
+
+
+current_request_context: ContextVar[Optional[RequestContext]] = ContextVar("current_request_context", default=None)
+
+
+def bind_user_id(user_id: int):
+    context = current_request_context.get()
+    if context is not None:
+        context.user_id = user_id
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rate: float = None):
+        super().__init__()
+        self.rate = AppSettings().log_info_sample_rate if rate is None else rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        # sample whole requests so that a kept request keeps all of its records
+        context = current_request_context.get()
+        if context is None:
+            sampled = random.random() < self.rate
+        else:
+            sampled = zlib.crc32(context.request_id.encode()) / 2 ** 32 < self.rate
+        if not sampled:
+            log_records_sampled_out.inc()
+        return sampled
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_FIELDS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        context = current_request_context.get()
+        if context is not None:
+            for field in CONTEXT_FIELDS:
+                if not hasattr(record, field):
+                    setattr(record, field, getattr(context, field))
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+def create_output_handlers(filename: str, max_bytes: int, backup_count: int) -> list[logging.Handler]:
+    formatter = JsonFormatter()
+    handlers = [
+        logging.StreamHandler(sys.stdout),
+        RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def create_queue_handler(
+        filename: str,
+        max_bytes: int,
+        backup_count: int,
+        queue_size: int = None
+) -> DroppingQueueHandler:
+    global queue_listener
+    # the config may be applied again, which replaces the previous listener and its files
+    stop_queue_listener()
+    log_queue = queue.Queue(maxsize=AppSettings().log_queue_size if queue_size is None else queue_size)
+    queue_listener = QueueListener(
+        log_queue, *create_output_handlers(filename, max_bytes, backup_count), respect_handler_level=True
+    )
+    queue_listener.start()
+    return DroppingQueueHandler(log_queue)
+
+
+@atexit.register
+def stop_queue_listener():
+    global queue_listener
+    if queue_listener is None:
+        return
+    try:
+        queue_listener.stop()
+    except queue.Full:
+        pass
+    for handler in queue_listener.handlers:
+        handler.close()
+    queue_listener = None
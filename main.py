@@ -1,19 +1,23 @@
 from datetime import date
+from typing import Optional
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Query, Request, Response, UploadFile, File, Header
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import database_crud
+import metrics
+import serialization
 import service
+import utils
 from auth import verify_token
+from instrumentation import InstrumentationMiddleware
 
-from database import SessionLocal, Base, engine
+from database import AsyncSessionLocal
 from models import CategoryCreate, Category, TransactionCreate, Transaction, CategoryUpdate, TransactionUpdate, \
-    Settings, SettingsUpdate, User, Token
-
-Base.metadata.create_all(bind=engine)
+    Settings, SettingsUpdate, User, Token, TransactionImportReport, Job, CategoryTimeSeries, ChangeFeed
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="signin")
 app = FastAPI()
@@ -25,86 +29,173 @@ app.add_middleware(
     allow_headers=["*"],
 )
 v1 = FastAPI()
+v1.add_middleware(InstrumentationMiddleware)
 
 
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    db = AsyncSessionLocal()
     try:
         yield db
     except:
-        db.rollback()
+        await db.rollback()
+        raise
     finally:
-        db.close()
+        await db.close()
+
+
+class NotModified(Exception):
+
+    def __init__(self, etag: str):
+        self.etag = etag
+
 
+def get_etag_headers(etag: Optional[str]) -> dict:
+    return {} if etag is None else {"ETag": etag, "Cache-Control": "private, no-cache"}
 
-@v1.get("/state")
-async def root(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    user_id = verify_token(db, token)
-    incomes = database_crud.get_incomes(db, user_id)
-    accounts = database_crud.get_accounts(db, user_id)
-    expenses = database_crud.get_expenses(db, user_id)
+
+@v1.exception_handler(NotModified)
+async def not_modified(request: Request, error: NotModified):
+    return Response(status_code=304, headers=get_etag_headers(error.etag))
+
+
+async def get_etag(
+        request: Request,
+        response: Response,
+        if_none_match: Optional[str] = Header(None),
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+) -> Optional[str]:
+    # converted amounts also depend on exchange rates, which are not part of the user's data version
+    if request.query_params.get("convert", "").lower() in ("1", "true", "on", "yes"):
+        return None
+    etag = await service.get_data_etag(db, f"{request.url.path}?{request.url.query}", token)
+    if if_none_match is not None and utils.etag_matches(if_none_match, etag):
+        raise NotModified(etag)
+    response.headers.update(get_etag_headers(etag))
+    return etag
+
+
+@v1.get("/state", dependencies=[Depends(get_etag)])
+async def root(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    user_id = await verify_token(db, token)
+    incomes = await database_crud.get_incomes(db, user_id)
+    accounts = await database_crud.get_accounts(db, user_id)
+    expenses = await database_crud.get_expenses(db, user_id)
     return {
         "state": {
-            "user": database_crud.get_user(db, user_id),
-            "settings": database_crud.get_user_settings(db, user_id),
+            "user": await database_crud.get_user(db, user_id),
+            "settings": await database_crud.get_user_settings(db, user_id),
             "incomes": incomes,
             "accounts": accounts,
             "expenses": expenses,
-            "transactions": database_crud.get_transactions(db, user_id)
+            "transactions": await database_crud.get_transactions(db, user_id)
         }
     }
 
 
+@v1.get("/state/stream")
+async def stream_state(
+        cursor: str = None,
+        page_size: int = Query(1000, ge=1, le=10000),
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    lines = await service.get_state_stream(db, cursor, page_size, token)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+@v1.get("/events")
+async def stream_events(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    lines = await service.get_event_stream(db, token)
+    return StreamingResponse(
+        lines, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@v1.get("/changes", response_model=ChangeFeed)
+async def get_changes(
+        cursor: int = Query(None, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    return serialization.FastJSONResponse(await service.get_changes(db, cursor, limit, token))
+
+
 @v1.post("/signup", response_model=Token)
-async def signup(data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)) -> Token:
-    return service.signup(db, data)
+async def signup(data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)) -> Token:
+    return await service.signup(db, data)
 
 
 @v1.post("/signin", response_model=Token)
-async def signin(data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)) -> Token:
-    return service.signin(db, data)
+async def signin(data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)) -> Token:
+    return await service.signin(db, data)
 
 
 @v1.get("/users", response_model=list[User])
-async def get_users(db: Session = Depends(get_db)):
-    return database_crud.get_users(db)
+async def get_users(db: AsyncSession = Depends(get_db)):
+    return serialization.FastJSONResponse(serialization.rows_to_dicts(await database_crud.get_users(db)))
 
 
-@v1.get("/settings", response_model=Settings)
-async def get_user_settings(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return service.get_user_settings(db, token)
+@v1.get("/settings", response_model=Settings, dependencies=[Depends(get_etag)])
+async def get_user_settings(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await service.get_user_settings(db, token)
 
 
 @v1.patch("/settings", response_model=Settings)
 async def update_user_settings(
         settings_update: SettingsUpdate,
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.update_user_settings(db, settings_update, token)
+    return await service.update_user_settings(db, settings_update, token)
 
 
 @v1.get("/incomes", response_model=list[Category])
 async def get_incomes(
         period_offset: int = 0,
+        convert: bool = False,
+        etag: Optional[str] = Depends(get_etag),
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.get_incomes(db, period_offset, token)
+    return serialization.FastJSONResponse(
+        await service.get_incomes(db, period_offset, convert, token), headers=get_etag_headers(etag)
+    )
 
 
 @v1.get("/accounts", response_model=list[Category])
-async def get_accounts(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return service.get_accounts(db, token)
+async def get_accounts(
+        etag: Optional[str] = Depends(get_etag),
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    return serialization.FastJSONResponse(await service.get_accounts(db, token), headers=get_etag_headers(etag))
 
 
 @v1.get("/expenses", response_model=list[Category])
 async def get_expenses(
         period_offset: int = 0,
+        convert: bool = False,
+        etag: Optional[str] = Depends(get_etag),
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    return serialization.FastJSONResponse(
+        await service.get_expenses(db, period_offset, convert, token), headers=get_etag_headers(etag)
+    )
+
+
+@v1.get("/time-series", response_model=CategoryTimeSeries)
+async def get_time_series(
+        category_type: int = Query(..., alias="type"),
+        period_offset_from: int = -11,
+        period_offset_to: int = 0,
+        convert: bool = False,
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.get_expenses(db, period_offset, token)
+    return await service.get_time_series(db, category_type, period_offset_from, period_offset_to, convert, token)
 
 
 @v1.get("/categories/{category_id}", response_model=Category)
@@ -112,17 +203,18 @@ async def get_category(
         category_id: int,
         period_offset: int = 0,
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)):
-    return service.get_category(db, category_id, period_offset, token)
+        db: AsyncSession = Depends(get_db)):
+    return await service.get_category(db, category_id, period_offset, token)
 
 
 @v1.post("/categories", response_model=Category)
 async def add_category(
         category_create: CategoryCreate,
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.add_category(db, category_create, token)
+    return await service.add_category(db, category_create, idempotency_key, token)
 
 
 @v1.patch("/categories/{category_id}", response_model=Category)
@@ -130,41 +222,81 @@ async def update_category(
         category_update: CategoryUpdate,
         category_id: int,
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)):
-    return service.update_category(db, category_update, category_id, token)
+        db: AsyncSession = Depends(get_db)):
+    return await service.update_category(db, category_update, category_id, token)
 
 
 @v1.delete("/categories/{category_id}", status_code=204)
-async def delete_category(category_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return service.delete_category(db, category_id, token)
+async def delete_category(
+        category_id: int,
+        background: bool = False,
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    job = await service.delete_category(db, category_id, background, token)
+    if job is not None:
+        return JSONResponse(status_code=202, content=job.dict())
+
+
+@v1.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await service.get_job(db, job_id, token)
 
 
 @v1.post("/income-account-transactions", response_model=Transaction)
 async def add_income_account_transaction(
         transaction_create: TransactionCreate,
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.add_income_account_transaction(db, transaction_create, token)
+    return await service.add_income_account_transaction(db, transaction_create, idempotency_key, token)
 
 
 @v1.post("/account-expense-transactions", response_model=Transaction)
 async def add_account_expense_transaction(
         transaction_create: TransactionCreate,
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.add_account_expense_transaction(db, transaction_create, token)
+    return await service.add_account_expense_transaction(db, transaction_create, idempotency_key, token)
+
+
+@v1.post("/transactions/import", response_model=TransactionImportReport)
+async def import_transactions(
+        rows: list[dict],
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    return await service.import_transactions(db, rows, token)
+
+
+@v1.post("/transactions/import/csv", response_model=TransactionImportReport)
+async def import_transactions_csv(
+        file: UploadFile = File(...),
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_db)
+):
+    return await service.import_transactions_csv(db, file, token)
 
 
 @v1.get("/categories/{category_id}/transactions", response_model=list[Transaction])
 async def get_category_transactions(
         category_id: int,
         period_offset: int = 0,
+        cursor: str = None,
+        limit: int = Query(100, ge=1, le=1000),
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.get_category_transactions(db, category_id, period_offset, token)
+    transactions, next_cursor = await service.get_category_transactions(
+        db, category_id, period_offset, cursor, limit, token
+    )
+    response = serialization.FastJSONResponse(transactions)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @v1.patch("/transactions/{transaction_id}", response_model=Transaction)
@@ -172,14 +304,20 @@ async def update_transaction(
         transaction_update: TransactionUpdate,
         transaction_id: int,
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    return service.update_transaction(db, transaction_update, transaction_id, token)
+    return await service.update_transaction(db, transaction_update, transaction_id, token)
 
 
 @v1.delete("/transactions/{transaction_id}", status_code=204)
-async def delete_transaction(transaction_id: int, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    return service.delete_transaction(db, transaction_id, token)
+async def delete_transaction(transaction_id: int, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await service.delete_transaction(db, transaction_id, token)
+
+
+# served outside /api so that only scrapers inside the deployment reach it, never the public router
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 app.mount("/api/v1", v1)
@@ -0,0 +1,104 @@
+import threading
+from typing import Callable
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = []
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        registry.append(self)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = buckets
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            bucket_counts, total = self.values.setdefault(key, [[0] * len(self.buckets), [0, 0.0]])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[index] += 1
+            total[0] += 1
+            total[1] += value
+
+
+class FunctionMetric(Metric):
+
+    def __init__(self, name: str, description: str, metric_type: str, function: Callable[[], float]):
+        super().__init__(name, description)
+        self.metric_type = metric_type
+        self.function = function
+
+
+def format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_metric(metric: Metric) -> list[str]:
+    lines = [f"# HELP {metric.name} {metric.description}", f"# TYPE {metric.name} {metric.metric_type}"]
+    if isinstance(metric, FunctionMetric):
+        lines.append(f"{metric.name} {metric.function()}")
+        return lines
+
+    with metric._lock:
+        if isinstance(metric, Histogram):
+            values = [(labels, ([*counts], [*total])) for labels, (counts, total) in metric.values.items()]
+        else:
+            values = list(metric.values.items())
+
+    for labels, value in sorted(values):
+        if isinstance(metric, Histogram):
+            bucket_counts, (count, total) = value
+            for bound, bucket_count in zip(metric.buckets, bucket_counts):
+                lines.append(f"{metric.name}_bucket{format_labels(labels, (('le', bound),))} {bucket_count}")
+            lines.append(f"{metric.name}_bucket{format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{metric.name}_count{format_labels(labels)} {count}")
+            lines.append(f"{metric.name}_sum{format_labels(labels)} {total}")
+        else:
+            lines.append(f"{metric.name}{format_labels(labels)} {value}")
+    return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in render_metric(metric)) + "\n"
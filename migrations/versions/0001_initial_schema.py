@@ -0,0 +1,71 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases created by the old Base.metadata.create_all call already have these tables
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "users" not in existing_tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("login", sa.String(), nullable=False),
+            sa.Column("password", sa.String(), nullable=False)
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_login", "users", ["login"], unique=True)
+
+    if "settings" not in existing_tables:
+        op.create_table(
+            "settings",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("start_date", sa.Date(), nullable=False),
+            sa.Column("base_currency", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"))
+        )
+        op.create_index("ix_settings_id", "settings", ["id"])
+
+    if "categories" not in existing_tables:
+        op.create_table(
+            "categories",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("type", sa.Integer(), nullable=False),
+            sa.Column("amount", sa.Float(), nullable=False),
+            sa.Column("currency", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"))
+        )
+        op.create_index("ix_categories_id", "categories", ["id"])
+
+    if "transactions" not in existing_tables:
+        op.create_table(
+            "transactions",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("amount", sa.Float(), nullable=False),
+            sa.Column("source", sa.Integer(), nullable=False),
+            sa.Column("destination", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("timestamp", sa.DateTime(), nullable=False)
+        )
+        op.create_index("ix_transactions_id", "transactions", ["id"])
+
+
+def downgrade():
+    op.drop_table("transactions")
+    op.drop_table("categories")
+    op.drop_table("settings")
+    op.drop_table("users")
@@ -0,0 +1,34 @@
+"""composite indexes for transaction and category hot paths
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_transactions_source_timestamp", "transactions", ["source", "timestamp"]),
+    ("ix_transactions_destination_timestamp", "transactions", ["destination", "timestamp"]),
+    ("ix_transactions_user_id_timestamp", "transactions", ["user_id", "timestamp"]),
+    ("ix_categories_user_id_type", "categories", ["user_id", "type"]),
+]
+
+
+def upgrade():
+    # build without locking writes on large tables; CONCURRENTLY can not run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
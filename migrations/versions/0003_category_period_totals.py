@@ -0,0 +1,40 @@
+"""monthly per-category rollup of transaction amounts
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "category_period_totals",
+        sa.Column("category_id", sa.Integer(), primary_key=True),
+        sa.Column("month", sa.Date(), primary_key=True),
+        sa.Column("amount", sa.Float(), nullable=False)
+    )
+    op.execute(
+        """
+        INSERT INTO category_period_totals (category_id, month, amount)
+        SELECT category_id, date_trunc('month', timestamp)::date AS month, sum(amount)
+        FROM (
+            SELECT source AS category_id, timestamp, amount FROM transactions
+            UNION ALL
+            SELECT destination AS category_id, timestamp, amount FROM transactions
+        ) AS sides
+        GROUP BY category_id, month
+        """
+    )
+
+
+def downgrade():
+    op.drop_table("category_period_totals")
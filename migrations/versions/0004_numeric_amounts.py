@@ -0,0 +1,57 @@
+"""store money amounts as numeric(14, 2) instead of double precision
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+TABLES = ["transactions", "categories", "category_period_totals"]
+
+
+def upgrade():
+    for table in TABLES:
+        op.alter_column(
+            table,
+            "amount",
+            type_=sa.Numeric(14, 2),
+            existing_type=sa.Float(),
+            existing_nullable=False,
+            postgresql_using="round(amount::numeric, 2)"
+        )
+    op.execute(
+        """
+        UPDATE category_period_totals
+        SET amount = sums.amount
+        FROM (
+            SELECT category_id, date_trunc('month', timestamp)::date AS month, sum(amount) AS amount
+            FROM (
+                SELECT source AS category_id, timestamp, amount FROM transactions
+                UNION ALL
+                SELECT destination AS category_id, timestamp, amount FROM transactions
+            ) AS sides
+            GROUP BY category_id, month
+        ) AS sums
+        WHERE category_period_totals.category_id = sums.category_id
+            AND category_period_totals.month = sums.month
+        """
+    )
+
+
+def downgrade():
+    for table in TABLES:
+        op.alter_column(
+            table,
+            "amount",
+            type_=sa.Float(),
+            existing_type=sa.Numeric(14, 2),
+            existing_nullable=False
+        )
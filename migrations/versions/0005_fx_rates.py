@@ -0,0 +1,28 @@
+"""daily exchange rates for converting category totals into the base currency
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "fx_rates",
+        sa.Column("currency", sa.Integer(), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("rate", sa.Numeric(18, 8), nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table("fx_rates")
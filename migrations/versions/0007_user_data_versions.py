@@ -0,0 +1,23 @@
+"""per-user data version for conditional GET requests
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("users", sa.Column("data_version", sa.BigInteger(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    op.drop_column("users", "data_version")
@@ -0,0 +1,33 @@
+"""append-only change log for incremental sync
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 13:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "changes",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("change_seq", sa.BigInteger(), nullable=False),
+        sa.Column("entity", sa.String(), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("deleted", sa.Boolean(), nullable=False)
+    )
+    op.create_index("ix_changes_user_id_change_seq", "changes", ["user_id", "change_seq"])
+
+
+def downgrade():
+    op.drop_index("ix_changes_user_id_change_seq", table_name="changes")
+    op.drop_table("changes")
@@ -0,0 +1,25 @@
+"""start existing billing cycles on the 1st of the month
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # settings.start_date used to hold the signup time and periods were always calendar months,
+    # so moving every existing row to the 1st keeps the windows those users already see
+    op.execute("UPDATE settings SET start_date = date_trunc('month', start_date)::date")
+
+
+def downgrade():
+    # the original days had no effect before this revision, so there is nothing to restore
+    pass
@@ -1,10 +1,13 @@
 import datetime
+from decimal import Decimal
 from enum import Enum
 from typing import Optional
 
 from fastapi import HTTPException
 from pydantic import BaseModel, validator
 
+import utils
+
 
 class Currency(Enum):
     EUR = 0
@@ -18,6 +21,12 @@ class CategoryType(Enum):
     EXPENSE = 3
 
 
+class SyncEntity(Enum):
+    CATEGORY = "category"
+    TRANSACTION = "transaction"
+    SETTINGS = "settings"
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -66,9 +75,13 @@ class Settings(SettingsBase):
 class CategoryBase(BaseModel):
     name: str
     type: int
-    amount: float = 0.0
+    amount: Decimal = Decimal(0)
     currency: int = Currency.EUR.value
 
+    @validator('amount')
+    def amount_in_cents(cls, v):
+        return None if v is None else utils.to_stored_money(v)
+
 
 class CategoryCreate(CategoryBase):
     pass
@@ -77,7 +90,7 @@ class CategoryCreate(CategoryBase):
 class CategoryUpdate(CategoryBase):
     name: Optional[str]
     type: Optional[int]
-    amount: Optional[float]
+    amount: Optional[Decimal]
     currency: Optional[int]
 
 
@@ -90,7 +103,7 @@ class Category(CategoryBase):
 
 
 class TransactionBase(BaseModel):
-    amount: float
+    amount: Decimal
     source: int
     destination: int
     timestamp: datetime.datetime
@@ -99,7 +112,7 @@ class TransactionBase(BaseModel):
     def amount_great_than_zero(cls, v):
         if v < 0:
             raise HTTPException(status_code=400, detail="amount should not be negative")
-        return v
+        return utils.to_stored_money(v)
 
     @validator('destination')
     def destination_not_equal_source(cls, v, values):
@@ -107,13 +120,17 @@ class TransactionBase(BaseModel):
             raise HTTPException(status_code=400, detail="destination should not be equal to source")
         return v
 
+    @validator('timestamp')
+    def timestamp_in_naive_utc(cls, v):
+        return None if v is None else utils.to_naive_utc(v)
+
 
 class TransactionCreate(TransactionBase):
     pass
 
 
 class TransactionUpdate(TransactionBase):
-    amount: Optional[float]
+    amount: Optional[Decimal]
     source: Optional[int]
     destination: Optional[int]
     timestamp: Optional[datetime.datetime]
@@ -125,3 +142,41 @@ class Transaction(TransactionBase):
 
     class Config:
         orm_mode = True
+
+
+class CategoryTimeSeries(BaseModel):
+    type: int
+    currency: Optional[int]
+    period_starts: list[datetime.date]
+    category_ids: list[int]
+    currencies: list[int]
+    amounts: list[list[Decimal]]
+
+
+class ChangeFeed(BaseModel):
+    cursor: int
+    has_more: bool = False
+    categories: list[Category] = []
+    transactions: list[Transaction] = []
+    settings: Optional[Settings] = None
+    deleted_categories: list[int] = []
+    deleted_transactions: list[int] = []
+
+
+class TransactionImportRejection(BaseModel):
+    row: int
+    detail: str
+
+
+class TransactionImportReport(BaseModel):
+    imported: int
+    rejected: list[TransactionImportRejection] = []
+
+
+class Job(BaseModel):
+    id: str
+    user_id: int
+    status: str = "running"
+    total: int = 0
+    processed: int = 0
+    detail: Optional[str]
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import math
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlparse
+
+import metrics
+import utils
+from app_settings import AppSettings
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CURRENT_TTL_SECONDS = AppSettings().period_cache_current_ttl_seconds
+
+period_cache_hits = metrics.Counter("period_cache_hits_total", "period sums served from the cache")
+period_cache_misses = metrics.Counter("period_cache_misses_total", "period sums aggregated from the database")
+period_cache_errors = metrics.Counter("period_cache_errors_total", "period cache backend failures")
+
+
+class MemoryBackend:
+
+    def __init__(self, max_size: int):
+        self.entries = TTLCache(max_size=max_size, ttl_seconds=math.inf)
+
+    async def get_many(self, keys: list[str]) -> list[Optional[str]]:
+        return [self.entries.get(key) for key in keys]
+
+    async def set(self, key: str, value: str, ttl_seconds: float = None):
+        self.entries.set(key, value, ttl_seconds)
+
+    async def add(self, key: str, value: str) -> str:
+        existing = self.entries.get(key)
+        if existing is not None:
+            return existing
+        self.entries.set(key, value)
+        return value
+
+
+class RedisBackend:
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.lstrip("/") or 0)
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+        self.lock: asyncio.Lock = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        if self.password is not None:
+            await self.send("AUTH", self.password)
+        if self.database:
+            await self.send("SELECT", self.database)
+
+    async def send(self, *args):
+        command = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            value = str(arg).encode()
+            command.append(f"${len(value)}\r\n".encode() + value + b"\r\n")
+        self.writer.write(b"".join(command))
+        await self.writer.drain()
+        return await self.read_reply()
+
+    async def read_reply(self):
+        line = (await self.reader.readline()).rstrip(b"\r\n")
+        if not line:
+            raise ConnectionError("redis connection closed")
+        prefix, payload = line[:1], line[1:].decode()
+        if prefix == b"+":
+            return payload
+        if prefix == b"-":
+            raise ConnectionError(f"redis error: {payload}")
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            if int(payload) < 0:
+                return None
+            value = await self.reader.readexactly(int(payload) + 2)
+            return value[:-2].decode()
+        if prefix == b"*":
+            return None if int(payload) < 0 else [await self.read_reply() for _ in range(int(payload))]
+        raise ConnectionError(f"unexpected redis reply {line!r}")
+
+    async def execute(self, *args):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            try:
+                if self.writer is None or self.writer.is_closing():
+                    await self.connect()
+                return await self.send(*args)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                if self.writer is not None:
+                    self.writer.close()
+                self.writer = None
+                raise
+
+    async def get_many(self, keys: list[str]) -> list[Optional[str]]:
+        return await self.execute("MGET", *keys)
+
+    async def set(self, key: str, value: str, ttl_seconds: float = None):
+        if ttl_seconds is None:
+            await self.execute("SET", key, value)
+        else:
+            await self.execute("SET", key, value, "PX", max(int(ttl_seconds * 1000), 1))
+
+    async def add(self, key: str, value: str) -> str:
+        await self.execute("SET", key, value, "NX")
+        return (await self.get_many([key]))[0]
+
+
+def create_backend():
+    settings = AppSettings()
+    if settings.period_cache_backend == "redis":
+        return RedisBackend(settings.period_cache_redis_url)
+    return MemoryBackend(settings.period_cache_max_size)
+
+
+backend = create_backend()
+
+
+def get_generation_key(user_id: int, month: date) -> str:
+    return f"period-generation:{user_id}:{month.isoformat()}"
+
+
+def get_sums_key(user_id: int, category_type: int, period: tuple[date, date], generations: list[str]) -> str:
+    return f"period-sums:{user_id}:{category_type}:{period[0].isoformat()}:{period[1].isoformat()}:" \
+           f"{'.'.join(generations)}"
+
+
+def get_ttl_seconds(period: tuple[date, date]) -> Optional[float]:
+    return None if period[1] <= datetime.utcnow().date() else CURRENT_TTL_SECONDS
+
+
+def encode_sums(sums: dict[int, Decimal]) -> str:
+    return json.dumps({str(category_id): str(amount) for category_id, amount in sums.items()})
+
+
+def decode_sums(value: str) -> dict[int, Decimal]:
+    return {int(category_id): Decimal(amount) for category_id, amount in json.loads(value).items()}
+
+
+async def get_generations(user_id: int, months: list[date]) -> dict[date, str]:
+    keys = [get_generation_key(user_id, month) for month in months]
+    generations = dict(zip(months, await backend.get_many(keys)))
+    for month, key in zip(months, keys):
+        if generations[month] is None:
+            generations[month] = await backend.add(key, uuid.uuid4().hex)
+    return generations
+
+
+async def get_or_load(
+        user_id: int,
+        category_type: int,
+        periods: list[tuple[date, date]],
+        load: Callable[[list[tuple[date, date]]], Awaitable[dict[date, dict[int, Decimal]]]]
+) -> dict[date, dict[int, Decimal]]:
+    try:
+        period_months = {period: utils.get_month_starts(*period) for period in periods}
+        generations = await get_generations(user_id, sorted(set().union(*period_months.values())))
+        keys = {
+            period: get_sums_key(user_id, category_type, period, [generations[month] for month in months])
+            for period, months in period_months.items()
+        }
+        cached = await backend.get_many(list(keys.values()))
+    except (OSError, ConnectionError, asyncio.IncompleteReadError):
+        logger.exception("period cache read failed")
+        period_cache_errors.inc()
+        return await load(periods)
+
+    sums = {period[0]: decode_sums(value) for period, value in zip(keys, cached) if value is not None}
+    missing = [period for period in periods if period[0] not in sums]
+    period_cache_hits.inc(len(sums))
+    if not missing:
+        return sums
+
+    period_cache_misses.inc(len(missing))
+    loaded = await load(missing)
+    for period in missing:
+        sums[period[0]] = loaded.get(period[0], {})
+    try:
+        for period in missing:
+            await backend.set(keys[period], encode_sums(sums[period[0]]), get_ttl_seconds(period))
+    except (OSError, ConnectionError, asyncio.IncompleteReadError):
+        logger.exception("period cache write failed")
+        period_cache_errors.inc()
+    return sums
+
+
+async def invalidate(periods: set[tuple[int, date]]):
+    try:
+        for user_id, month in periods:
+            await backend.set(get_generation_key(user_id, month), uuid.uuid4().hex)
+    except (OSError, ConnectionError, asyncio.IncompleteReadError):
+        logger.exception("period cache invalidation failed")
+        period_cache_errors.inc()
@@ -0,0 +1,32 @@
+import argparse
+import asyncio
+import sys
+
+import database_crud
+from database import AsyncSessionLocal
+
+
+async def run(command: str, user_id: int = None) -> list[tuple]:
+    async with AsyncSessionLocal() as db:
+        if command == "rebuild":
+            await database_crud.rebuild_category_period_totals(db, user_id)
+        return await database_crud.get_category_period_totals_drift(db, user_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="verify or rebuild the category_period_totals rollup")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--user-id", type=int, default=None, help="limit to the categories of one user")
+    args = parser.parse_args()
+
+    drift = asyncio.run(run(args.command, args.user_id))
+    for category_id, month, stored_amount, expected_amount in drift:
+        print(f"category {category_id} {month}: stored {stored_amount}, expected {expected_amount}")
+    print(f"{len(drift)} drifted rows")
+
+    if drift:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
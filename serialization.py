@@ -0,0 +1,37 @@
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from sqlalchemy.engine import Row
+
+
+def encode_value(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=encode_value)
+
+
+def loads(value: str) -> Any:
+    return orjson.loads(value)
+
+
+def rows_to_dicts(rows: list[Row]) -> list[dict]:
+    if not rows:
+        return []
+    # column labels can be str subclasses, which orjson refuses as dict keys
+    fields = [str(field) for field in rows[0]._fields]
+    return [dict(zip(fields, row)) for row in rows]
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
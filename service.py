@@ -1,206 +1,591 @@
-from datetime import date
-
+import asyncio
+import csv
+import hashlib
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from fastapi import HTTPException, UploadFile
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import database_crud
-from database_models import TransactionDb, CategoryDb, SettingsDb
+import events
+import fx
+import jobs
+import serialization
+from loaders import get_category_loader
+from app_settings import AppSettings
+from database import AsyncSessionLocal
+from database_models import TransactionDb, CategoryDb, SettingsDb, IdempotencyKeyDb
 from models import TransactionCreate, CategoryUpdate, TransactionUpdate, UserCreate, SettingsUpdate, TokenData, \
-    CategoryCreate, Token, CategoryType
+    CategoryCreate, Token, CategoryType, User, Settings, Category, Transaction, TransactionImportReport, \
+    TransactionImportRejection, Job, CategoryTimeSeries, ChangeFeed, SyncEntity
 import validation
 import auth
 import utils
 
+IMPORT_MAX_ROWS = 100000
+DELETE_BATCH_SIZE = 5000
+TIME_SERIES_MAX_MONTHS = 120
+EVENTS_HEARTBEAT_SECONDS = AppSettings().events_heartbeat_seconds
+
+T = TypeVar("T")
 
-def signup(db: Session, data: OAuth2PasswordRequestForm) -> Token:
-    validation.validate_login_exists(data.username, database_crud.get_user_by_login(db, data.username))
-    hashed_password = auth.get_hashed_password(data.password)
+
+async def signup(db: AsyncSession, data: OAuth2PasswordRequestForm) -> Token:
+    validation.validate_login_exists(data.username, await database_crud.get_user_by_login(db, data.username))
+    hashed_password = await auth.get_hashed_password(data.password)
     user_create_hashed = UserCreate(login=data.username, password=hashed_password)
-    user = database_crud.create_user(db, user_create_hashed)
+    user = await database_crud.create_user(db, user_create_hashed)
 
     token = auth.create_token(TokenData(user_id=user.id).dict())
     return Token(access_token=token)
 
 
-def signin(db: Session, data: OAuth2PasswordRequestForm) -> Token:
-    user = database_crud.get_user_by_login(db, data.username)
+async def signin(db: AsyncSession, data: OAuth2PasswordRequestForm) -> Token:
+    user = await database_crud.get_user_by_login(db, data.username)
     validation.validate_login_is_not_existed(user)
-    auth.verify_password(data.password, user.password)
+    await auth.verify_password(data.password, user.password)
 
     token = auth.create_token(TokenData(user_id=user.id).dict())
     return Token(access_token=token)
 
 
-def get_user_settings(db: Session, token: str) -> SettingsDb:
-    user_id = auth.verify_token(db, token)
-    return database_crud.get_user_settings(db, user_id)
+def state_line(line_type: str, data: dict) -> str:
+    return json.dumps({"type": line_type, "data": jsonable_encoder(data)}) + "\n"
 
 
-def update_user_settings(db: Session, settings_update: SettingsUpdate, token: str) -> SettingsDb:
-    user_id = auth.verify_token(db, token)
-    return database_crud.update_user_settings(db, settings_update, user_id)
+async def get_state_stream(db: AsyncSession, cursor: str, page_size: int, token: str) -> AsyncIterator[str]:
+    user_id = await auth.verify_token(db, token)
+    validation.validate_cursor(cursor)
+    after = None if cursor is None else utils.decode_cursor(cursor)
+    return state_stream_lines(db, user_id, after, page_size)
 
 
-def get_incomes(db: Session, period_offset: int, token: str) -> list[CategoryDb]:
-    user_id = auth.verify_token(db, token)
-    incomes = database_crud.get_incomes(db, user_id)
-    period = utils.get_period(period_offset)
+async def state_stream_lines(
+        db: AsyncSession,
+        user_id: int,
+        after: tuple,
+        page_size: int
+) -> AsyncIterator[str]:
+    if after is None:
+        yield state_line("user", User.from_orm(await database_crud.get_user(db, user_id)).dict())
+        yield state_line("settings", Settings.from_orm(await database_crud.get_user_settings(db, user_id)).dict())
+        for category in await database_crud.get_user_categories(db, user_id):
+            yield state_line("category", Category.from_orm(category).dict())
 
-    for income in incomes:
-        amount = database_crud.get_category_period_sum(
-            db,
-            income.id,
-            period_start=period[0],
-            period_end=period[1]
-        )
-        income.amount = utils.round_float(amount)
+    streamed = 0
+    async for transaction in database_crud.stream_transactions(db, user_id, after, batch_size=page_size):
+        yield state_line("transaction", Transaction.from_orm(transaction).dict())
+        streamed += 1
+        if streamed % page_size == 0:
+            yield state_line("cursor", {"cursor": utils.encode_cursor(transaction.timestamp, transaction.id)})
 
-    return incomes
+    yield state_line("end", {"transactions": streamed})
 
 
-def get_accounts(db: Session, token: str) -> list[CategoryDb]:
-    user_id = auth.verify_token(db, token)
-    accounts = database_crud.get_accounts(db, user_id)
-    for account in accounts:
-        account.amount = utils.round_float(account.amount)
-    return accounts
+async def get_data_etag(db: AsyncSession, resource: str, token: str) -> str:
+    user_id = await auth.verify_token(db, token)
+    version = await database_crud.get_data_version(db, user_id)
+    # period offsets are relative to today, so the same version renders differently on another day
+    digest = hashlib.sha1(f"{resource}:{datetime.utcnow().date().isoformat()}".encode()).hexdigest()[:16]
+    return f'W/"{user_id}.{version}.{digest}"'
 
 
-def get_expenses(db: Session, period_offset: int, token: str) -> list[CategoryDb]:
-    user_id = auth.verify_token(db, token)
-    expenses = database_crud.get_expenses(db, user_id)
-    period = utils.get_period(period_offset)
+async def get_changes(db: AsyncSession, cursor: Optional[int], limit: int, token: str) -> dict:
+    user_id = await auth.verify_token(db, token)
+    if cursor is None:
+        # a client without a cursor takes the current version first and then loads /state
+        return ChangeFeed(cursor=await database_crud.get_data_version(db, user_id)).dict()
 
-    for expense in expenses:
-        amount = database_crud.get_category_period_sum(
-            db,
-            expense.id,
-            period_start=period[0],
-            period_end=period[1]
+    change_seqs = await database_crud.get_change_seqs(db, user_id, cursor, limit + 1)
+    if not change_seqs:
+        return ChangeFeed(cursor=cursor).dict()
+    up_to = change_seqs[:limit][-1]
+
+    latest = {}
+    for entity, entity_id, deleted in await database_crud.get_changes(db, user_id, cursor, up_to):
+        latest[(entity, entity_id)] = deleted
+
+    def get_ids(entity: SyncEntity, deleted: bool) -> list[int]:
+        return sorted(
+            entity_id for (name, entity_id), is_deleted in latest.items()
+            if name == entity.value and is_deleted == deleted
         )
-        expense.amount = utils.round_float(amount)
 
-    return expenses
+    settings = []
+    if get_ids(SyncEntity.SETTINGS, False):
+        settings = serialization.rows_to_dicts(await database_crud.get_settings_rows(db, user_id))
+    return {
+        "cursor": up_to,
+        "has_more": len(change_seqs) > limit,
+        "categories": serialization.rows_to_dicts(
+            await database_crud.get_category_rows_by_ids(db, user_id, get_ids(SyncEntity.CATEGORY, False))
+        ),
+        "transactions": serialization.rows_to_dicts(
+            await database_crud.get_transaction_rows_by_ids(db, user_id, get_ids(SyncEntity.TRANSACTION, False))
+        ),
+        "settings": settings[0] if settings else None,
+        "deleted_categories": get_ids(SyncEntity.CATEGORY, True),
+        "deleted_transactions": get_ids(SyncEntity.TRANSACTION, True)
+    }
+
+
+def format_event(event_type: str, data: dict, event_id: int = None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event_type}", f"data: {serialization.dumps(data).decode()}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def get_event_stream(db: AsyncSession, token: str) -> AsyncIterator[str]:
+    user_id = await auth.verify_token(db, token)
+    version = await database_crud.get_data_version(db, user_id)
+    # the stream outlives the request, so it must not keep a pooled connection checked out
+    await db.close()
+    await events.backend.start()
+    return event_stream_lines(events.broker.subscribe(user_id), version)
+
+
+async def event_stream_lines(subscriber: events.Subscriber, version: int) -> AsyncIterator[str]:
+    try:
+        yield format_event("version", {"version": version}, version)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                yield format_event("evicted", {})
+                return
+            yield format_event(
+                "balances", {"version": event["version"], "categories": event["categories"]}, event["version"]
+            )
+    finally:
+        events.broker.unsubscribe(subscriber)
+
+
+async def get_user_settings(db: AsyncSession, token: str) -> SettingsDb:
+    user_id = await auth.verify_token(db, token)
+    return await database_crud.get_user_settings(db, user_id)
+
+
+async def update_user_settings(db: AsyncSession, settings_update: SettingsUpdate, token: str) -> SettingsDb:
+    user_id = await auth.verify_token(db, token)
+    settings = await retry_write(db, lambda: database_crud.update_user_settings(db, settings_update, user_id))
+    auth.invalidate_principal(user_id)
+    return settings
+
+
+async def get_versioned_settings(db: AsyncSession, user_id: int) -> Row:
+    settings = await database_crud.get_versioned_settings(db, user_id)
+    validation.validate_entity_exists(user_id, "user", settings, 401)
+    return settings
+
+
+async def get_user_period_calendar(
+        db: AsyncSession,
+        user_id: int,
+        period_offset_from: int,
+        period_offset_to: int
+) -> list[tuple]:
+    settings = await get_versioned_settings(db, user_id)
+    return utils.get_period_calendar(period_offset_from, period_offset_to, settings.start_date.day)
+
+
+async def get_user_period(db: AsyncSession, user_id: int, period_offset: int) -> tuple:
+    return (await get_user_period_calendar(db, user_id, period_offset, period_offset))[0]
+
+
+def get_period_categories(
+        categories: list[CategoryDb],
+        amounts: dict[int, Decimal],
+        currency: int = None
+) -> list[Category]:
+    update = {} if currency is None else {"currency": currency}
+    return [
+        Category.from_orm(category).copy(update={**update, "amount": amounts.get(category.id, Decimal(0))})
+        for category in categories
+    ]
+
+
+def get_period_category_rows(categories: list[Row], amounts: dict[int, Decimal], currency: int = None) -> list[dict]:
+    rows = serialization.rows_to_dicts(categories)
+    for row in rows:
+        row["amount"] = amounts.get(row["id"], Decimal(0))
+        if currency is not None:
+            row["currency"] = currency
+    return rows
+
+
+async def convert_to_base_currency(
+        db: AsyncSession,
+        user_id: int,
+        categories: list[CategoryDb],
+        period_sums: dict[date, dict[int, Decimal]],
+        periods: list[tuple]
+) -> tuple[int, dict[date, dict[int, Decimal]]]:
+    base_currency = (await get_versioned_settings(db, user_id)).base_currency
+    category_currencies = {category.id: category.currency for category in categories}
+    if all(currency == base_currency for currency in category_currencies.values()):
+        return base_currency, period_sums
+
+    index = await fx.get_rate_index(db)
+    validation.validate_exchange_rates(index, set(category_currencies.values()) | {base_currency})
+    return base_currency, fx.convert_period_sums(index, period_sums, periods, category_currencies, base_currency)
+
+
+async def get_converted_period_categories(
+        db: AsyncSession,
+        user_id: int,
+        categories: list[Row],
+        amounts: dict[int, Decimal],
+        period: tuple,
+        convert: bool
+) -> list[dict]:
+    if not convert:
+        return get_period_category_rows(categories, amounts)
+    currency, period_sums = await convert_to_base_currency(db, user_id, categories, {period[0]: amounts}, [period])
+    return get_period_category_rows(categories, period_sums.get(period[0], {}), currency)
+
+
+async def get_incomes(db: AsyncSession, period_offset: int, convert: bool, token: str) -> list[dict]:
+    user_id = await auth.verify_token(db, token)
+    incomes = await database_crud.get_category_rows_by_type(db, user_id, CategoryType.INCOME.value)
+    period = await get_user_period(db, user_id, period_offset)
+    amounts = await database_crud.get_categories_period_sums(
+        db,
+        user_id,
+        CategoryType.INCOME.value,
+        period_start=period[0],
+        period_end=period[1]
+    )
+
+    return await get_converted_period_categories(db, user_id, incomes, amounts, period, convert)
+
+
+async def get_accounts(db: AsyncSession, token: str) -> list[dict]:
+    user_id = await auth.verify_token(db, token)
+    return serialization.rows_to_dicts(
+        await database_crud.get_category_rows_by_type(db, user_id, CategoryType.ACCOUNT.value)
+    )
+
+
+async def get_expenses(db: AsyncSession, period_offset: int, convert: bool, token: str) -> list[dict]:
+    user_id = await auth.verify_token(db, token)
+    expenses = await database_crud.get_category_rows_by_type(db, user_id, CategoryType.EXPENSE.value)
+    period = await get_user_period(db, user_id, period_offset)
+    amounts = await database_crud.get_categories_period_sums(
+        db,
+        user_id,
+        CategoryType.EXPENSE.value,
+        period_start=period[0],
+        period_end=period[1]
+    )
+
+    return await get_converted_period_categories(db, user_id, expenses, amounts, period, convert)
+
+
+async def get_time_series(
+        db: AsyncSession,
+        category_type: int,
+        period_offset_from: int,
+        period_offset_to: int,
+        convert: bool,
+        token: str
+) -> CategoryTimeSeries:
+    user_id = await auth.verify_token(db, token)
+    validation.validate_category_type(category_type)
+    validation.validate_period_range(period_offset_from, period_offset_to, TIME_SERIES_MAX_MONTHS)
+    categories = await database_crud.get_categories_by_type(db, user_id, category_type)
+    periods = await get_user_period_calendar(db, user_id, period_offset_from, period_offset_to)
+    period_sums = await database_crud.get_categories_calendar_period_sums(db, user_id, category_type, periods)
+    currency = None
+    if convert:
+        currency, period_sums = await convert_to_base_currency(db, user_id, categories, period_sums, periods)
+
+    return CategoryTimeSeries(
+        type=category_type,
+        currency=currency,
+        period_starts=[period_start for period_start, _ in periods],
+        category_ids=[category.id for category in categories],
+        currencies=[category.currency if currency is None else currency for category in categories],
+        amounts=[
+            [period_sums.get(period_start, {}).get(category.id, Decimal(0)) for period_start, _ in periods]
+            for category in categories
+        ]
+    )
 
 
-def get_category(db: Session, category_id: int, period_offset: int, token: str) -> CategoryDb:
-    auth.verify_token(db, token)
-    category = database_crud.get_category_by_id(db, category_id)
+async def get_category(db: AsyncSession, category_id: int, period_offset: int, token: str) -> Category:
+    await auth.verify_token(db, token)
+    category = await get_category_loader(db).load(category_id)
     validation.validate_entity_exists(category_id, "category", category)
     if category.type == CategoryType.EXPENSE.value or category.type == CategoryType.INCOME.value:
-        period = utils.get_period(period_offset)
-        amount = database_crud.get_category_period_sum(
+        period = await get_user_period(db, category.user_id, period_offset)
+        amounts = await database_crud.get_categories_period_sums(
             db,
-            category_id,
+            category.user_id,
+            category.type,
             period_start=period[0],
             period_end=period[1]
         )
-        category.amount = amount
-    category.amount = utils.round_float(category.amount)
-    return category
+        return get_period_categories([category], amounts)[0]
+    return Category.from_orm(category)
+
+
+async def retry_write(db: AsyncSession, write: Callable[[], Awaitable[T]]) -> T:
+    try:
+        return await database_crud.run_with_retry(db, write)
+    except database_crud.WriteConflictError as error:
+        validation.raise_write_conflict(error)
+
+
+def get_request_hash(operation: str, request: BaseModel) -> str:
+    return hashlib.sha256(json.dumps([operation, jsonable_encoder(request)], sort_keys=True).encode()).hexdigest()
+
+
+async def create_idempotently(
+        db: AsyncSession,
+        user_id: int,
+        idempotency_key: Optional[str],
+        operation: str,
+        request: BaseModel,
+        create: Callable[[Optional[IdempotencyKeyDb]], Awaitable[T]],
+        load: Callable[[int], Awaitable[T]]
+) -> T:
+    if idempotency_key is None:
+        return await create(None)
+
+    request_hash = get_request_hash(operation, request)
+    stored_key = await database_crud.get_idempotency_key(db, user_id, idempotency_key)
+    if stored_key is None:
+        try:
+            return await create(IdempotencyKeyDb(user_id=user_id, key=idempotency_key, request_hash=request_hash))
+        except IntegrityError:
+            await db.rollback()
+            stored_key = await database_crud.get_idempotency_key(db, user_id, idempotency_key)
+            if stored_key is None:
+                raise
+
+    validation.validate_idempotent_replay(idempotency_key, stored_key.request_hash, request_hash)
+    resource = await load(stored_key.resource_id)
+    validation.validate_idempotent_resource_exists(idempotency_key, resource)
+    return resource
+
+
+async def add_category(
+        db: AsyncSession,
+        category_create: CategoryCreate,
+        idempotency_key: Optional[str],
+        token: str
+) -> CategoryDb:
+    user_id = await auth.verify_token(db, token)
+    return await create_idempotently(
+        db,
+        user_id,
+        idempotency_key,
+        "category",
+        category_create,
+        lambda key: retry_write(db, lambda: database_crud.create_category(db, category_create, user_id, key)),
+        lambda category_id: database_crud.get_category_by_id(db, category_id)
+    )
 
 
-def add_category(db: Session, category_create: CategoryCreate, token: str) -> CategoryDb:
-    user_id = auth.verify_token(db, token)
-    category =  database_crud.create_category(db, category_create, user_id)
-    category.amount = utils.round_float(category.amount)
-    return category
+async def update_category(
+        db: AsyncSession,
+        category_update: CategoryUpdate,
+        category_id: int,
+        token: str
+) -> CategoryDb:
+    await auth.verify_token(db, token)
+    category = await get_category_loader(db).load(category_id)
+    validation.validate_entity_exists(category_id, "category", category)
+    validation.validate_not_changing_category_type(category_update.type, category.type)
+    return await retry_write(db, lambda: database_crud.update_category(db, category_update, category_id))
 
 
-def update_category(db: Session, category_update: CategoryUpdate, category_id: int, token: str) -> CategoryDb:
-    auth.verify_token(db, token)
-    validation.validate_entity_exists(category_id, "category", database_crud.get_category_by_id(db, category_id))
-    validation.validate_not_changing_category_type(
-        category_update.type, database_crud.get_category_by_id(db, category_id).type
-    )
-    category = database_crud.update_category(db, category_update, category_id)
-    category.amount = utils.round_float(category.amount)
-    return category
+async def delete_category(db: AsyncSession, category_id: int, background: bool, token: str) -> Job:
+    user_id = await auth.verify_token(db, token)
+    validation.validate_entity_exists(category_id, "category", await get_category_loader(db).load(category_id))
+    get_category_loader(db).forget(category_id)
+    if background:
+        return jobs.start_job(user_id, lambda job: delete_category_job(job, category_id))
+    await retry_write(db, lambda: database_crud.delete_category(db, category_id))
 
 
-def delete_category(db: Session, category_id: int, token: str):
-    auth.verify_token(db, token)
-    validation.validate_entity_exists(category_id, "category", database_crud.get_category_by_id(db, category_id))
-    return database_crud.delete_category(db, category_id)
+async def delete_category_job(job: Job, category_id: int):
+    def on_progress(processed: int):
+        job.processed += processed
 
+    async with AsyncSessionLocal() as db:
+        job.total = await database_crud.count_category_transactions(db, category_id)
+        # batches already committed stay deleted, so a retry picks up the remaining transactions
+        await database_crud.run_with_retry(db, lambda: database_crud.delete_category(
+            db, category_id, batch_size=DELETE_BATCH_SIZE, on_progress=on_progress
+        ))
 
-def add_income_account_transaction(
-        db: Session,
+
+async def get_job(db: AsyncSession, job_id: str, token: str) -> Job:
+    user_id = await auth.verify_token(db, token)
+    job = jobs.get_job(job_id)
+    validation.validate_entity_exists(job_id, "job", None if job is None or job.user_id != user_id else job)
+    return job
+
+
+async def create_transaction_idempotently(
+        db: AsyncSession,
         transaction_create: TransactionCreate,
-        token: str
+        user_id: int,
+        idempotency_key: Optional[str],
+        operation: str
 ) -> TransactionDb:
-    user_id = auth.verify_token(db, token)
-    validation.validate_source_destination_exist(
-        transaction_create.source,
-        transaction_create.destination,
-        database_crud.get_category_ids(db, [transaction_create.source, transaction_create.destination])
-    )
-    validation.validate_income_account_source_type(database_crud.get_category_by_id(db, transaction_create.source).type)
-    validation.validate_income_account_destination_type(
-        database_crud.get_category_by_id(db, transaction_create.destination).type
+    return await create_idempotently(
+        db,
+        user_id,
+        idempotency_key,
+        operation,
+        transaction_create,
+        lambda key: retry_write(db, lambda: database_crud.create_transaction(db, transaction_create, user_id, key)),
+        lambda transaction_id: database_crud.get_transaction_by_id(db, transaction_id)
     )
 
-    return database_crud.create_transaction(db, transaction_create, user_id=user_id)
 
-
-def add_account_expense_transaction(
-        db: Session,
+async def add_income_account_transaction(
+        db: AsyncSession,
         transaction_create: TransactionCreate,
+        idempotency_key: Optional[str],
         token: str
 ) -> TransactionDb:
-    user_id = auth.verify_token(db, token)
-    validation.validate_source_destination_exist(
-        transaction_create.source,
-        transaction_create.destination,
-        database_crud.get_category_ids(db, [transaction_create.source, transaction_create.destination])
-    )
-    validation.validate_account_expense_source_type(
-        database_crud.get_category_by_id(db, transaction_create.source).type
-    )
-    validation.validate_account_expense_destination_type(
-        database_crud.get_category_by_id(db, transaction_create.destination).type
+    user_id = await auth.verify_token(db, token)
+    categories = await get_category_loader(db).load_many([transaction_create.source, transaction_create.destination])
+    validation.validate_source_destination_exist(transaction_create.source, transaction_create.destination, categories)
+    validation.validate_income_account_source_type(categories[transaction_create.source].type)
+    validation.validate_income_account_destination_type(categories[transaction_create.destination].type)
+
+    return await create_transaction_idempotently(
+        db, transaction_create, user_id, idempotency_key, "income-account-transaction"
     )
 
+
+async def add_account_expense_transaction(
+        db: AsyncSession,
+        transaction_create: TransactionCreate,
+        idempotency_key: Optional[str],
+        token: str
+) -> TransactionDb:
+    user_id = await auth.verify_token(db, token)
+    categories = await get_category_loader(db).load_many([transaction_create.source, transaction_create.destination])
+    validation.validate_source_destination_exist(transaction_create.source, transaction_create.destination, categories)
+    validation.validate_account_expense_source_type(categories[transaction_create.source].type)
+    validation.validate_account_expense_destination_type(categories[transaction_create.destination].type)
+
     transaction_create.timestamp = transaction_create.timestamp
-    return database_crud.create_transaction(db, transaction_create, user_id=user_id)
+    return await create_transaction_idempotently(
+        db, transaction_create, user_id, idempotency_key, "account-expense-transaction"
+    )
 
 
-def get_category_transactions(
-        db: Session,
+def get_validation_error_detail(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in error.errors())
+
+
+async def import_transactions(db: AsyncSession, rows: list[dict], token: str) -> TransactionImportReport:
+    user_id = await auth.verify_token(db, token)
+    validation.validate_import_size(rows, IMPORT_MAX_ROWS)
+    categories = await database_crud.get_user_categories(db, user_id)
+    get_category_loader(db).prime(categories)
+    category_types = {category.id: category.type for category in categories}
+
+    transaction_creates = []
+    rejected = []
+    for row_number, row in enumerate(rows):
+        try:
+            transaction_create = TransactionCreate(**row)
+            validation.validate_source_destination_exist(
+                transaction_create.source,
+                transaction_create.destination,
+                category_types
+            )
+            validation.validate_transaction_direction(
+                category_types[transaction_create.source],
+                category_types[transaction_create.destination]
+            )
+            transaction_creates.append(transaction_create)
+        except HTTPException as error:
+            rejected.append(TransactionImportRejection(row=row_number, detail=error.detail))
+        except ValidationError as error:
+            rejected.append(TransactionImportRejection(row=row_number, detail=get_validation_error_detail(error)))
+
+    if transaction_creates:
+        await retry_write(db, lambda: database_crud.create_transactions(db, transaction_creates, user_id))
+    return TransactionImportReport(imported=len(transaction_creates), rejected=rejected)
+
+
+async def import_transactions_csv(db: AsyncSession, file: UploadFile, token: str) -> TransactionImportReport:
+    content = (await file.read()).decode("utf-8-sig")
+    return await import_transactions(db, list(csv.DictReader(io.StringIO(content))), token)
+
+
+async def get_category_transactions(
+        db: AsyncSession,
         category_id: int,
         period_offset: int,
+        cursor: str,
+        limit: int,
         token: str
-) -> list[TransactionDb]:
-    auth.verify_token(db, token)
-    validation.validate_entity_exists(category_id, "category", database_crud.get_category_by_id(db, category_id))
-    period = utils.get_period(period_offset)
-    return database_crud.get_category_transactions(db, category_id, period_start=period[0], period_end=period[1])
+) -> tuple[list[dict], str]:
+    user_id = await auth.verify_token(db, token)
+    validation.validate_entity_exists(category_id, "category", await get_category_loader(db).load(category_id))
+    validation.validate_cursor(cursor)
+    period = await get_user_period(db, user_id, period_offset)
+    transactions = await database_crud.get_category_transactions_page(
+        db,
+        category_id,
+        period_start=period[0],
+        period_end=period[1],
+        before=None if cursor is None else utils.decode_cursor(cursor),
+        limit=limit + 1
+    )
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = utils.encode_cursor(transactions[-1].timestamp, transactions[-1].id)
+    return serialization.rows_to_dicts(transactions), next_cursor
 
 
 # TODO: add validation transaction direction validation
-def update_transaction(
-        db: Session,
+async def update_transaction(
+        db: AsyncSession,
         transaction_update: TransactionUpdate,
         transaction_id: int,
         token: str
 ) -> TransactionDb:
-    auth.verify_token(db, token)
+    await auth.verify_token(db, token)
     validation.validate_entity_exists(
         transaction_id,
-        "transaction", database_crud.get_transaction_by_id(db, transaction_id))
+        "transaction", await database_crud.get_transaction_by_id(db, transaction_id))
     validation.validate_source_destination_exist(
         transaction_update.source,
         transaction_update.destination,
-        database_crud.get_category_ids(db, [transaction_update.source, transaction_update.destination])
+        await get_category_loader(db).load_many([transaction_update.source, transaction_update.destination])
     )
-    return database_crud.update_transaction(db, transaction_update, transaction_id)
+    return await retry_write(db, lambda: database_crud.update_transaction(db, transaction_update, transaction_id))
 
 
-def delete_transaction(db: Session, transaction_id: int, token: str):
-    auth.verify_token(db, token)
+async def delete_transaction(db: AsyncSession, transaction_id: int, token: str):
+    await auth.verify_token(db, token)
     validation.validate_entity_exists(
         transaction_id,
         "transaction",
-        database_crud.get_transaction_by_id(db, transaction_id)
+        await database_crud.get_transaction_by_id(db, transaction_id)
     )
-    return database_crud.delete_transaction(db, transaction_id)
+    return await retry_write(db, lambda: database_crud.delete_transaction(db, transaction_id))
@@ -0,0 +1,70 @@
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+ROOT = Path(__file__).resolve().parent.parent
+
+# settings are read when the app modules are imported, so they must point at the test database first;
+# the engines only connect on first use, so without a test database the modules still import and the tests skip
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "postgresql://localhost/finance_app_test"
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+from alembic import command
+from alembic.config import Config
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+from database import async_engine
+from models import CategoryType
+
+
+@pytest.fixture(scope="session")
+def client() -> TestClient:
+    if TEST_DATABASE_URL is None:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    alembic_config = Config(str(ROOT / "alembic.ini"))
+    alembic_config.set_main_option("script_location", str(ROOT / "migrations"))
+    command.upgrade(alembic_config, "head")
+    with TestClient(main.v1) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def statements() -> list[str]:
+    executed = []
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def user(client: TestClient) -> dict:
+    response = client.post("/signup", data={"username": f"test-{uuid.uuid4().hex}", "password": "password"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    categories = {}
+    for name, category_type in (("salary", CategoryType.INCOME), ("card", CategoryType.ACCOUNT),
+                                ("food", CategoryType.EXPENSE), ("rent", CategoryType.EXPENSE)):
+        response = client.post("/categories", json={"name": name, "type": category_type.value}, headers=headers)
+        categories[name] = response.json()["id"]
+
+    timestamp = datetime.utcnow().isoformat()
+    transactions = [
+        client.post("/income-account-transactions", headers=headers, json={
+            "amount": 100, "source": categories["salary"], "destination": categories["card"], "timestamp": timestamp
+        }).json()["id"],
+        client.post("/account-expense-transactions", headers=headers, json={
+            "amount": 10, "source": categories["card"], "destination": categories["food"], "timestamp": timestamp
+        }).json()["id"]
+    ]
+    return {"headers": headers, "categories": categories, "transactions": transactions, "timestamp": timestamp}
@@ -0,0 +1,83 @@
+from database import AsyncSessionLocal
+from loaders import get_category_loader
+
+MISSING_CATEGORY_ID = 2 ** 31 - 1
+
+
+def run_in_session(client, load):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return await load(db)
+
+    return client.portal.call(run)
+
+
+def test_load_many_fetches_missing_categories_in_one_statement(client, user, statements):
+    ids = [user["categories"]["card"], user["categories"]["food"], MISSING_CATEGORY_ID]
+
+    async def load(db):
+        statements.clear()
+        return await get_category_loader(db).load_many(ids)
+
+    categories = run_in_session(client, load)
+
+    assert len(statements) == 1
+    assert set(categories) == set(ids[:2])
+    assert categories[ids[1]].name == "food"
+
+
+def test_loader_caches_categories_for_the_session(client, user, statements):
+    card, food = user["categories"]["card"], user["categories"]["food"]
+
+    async def load(db):
+        loader = get_category_loader(db)
+        await loader.load_many([card, MISSING_CATEGORY_ID])
+        statements.clear()
+        assert get_category_loader(db) is loader
+        assert (await loader.load(card)).id == card
+        assert await loader.load(MISSING_CATEGORY_ID) is None
+        cached_statements = len(statements)
+
+        assert (await loader.load_many([card, food]))[food].id == food
+        return cached_statements, len(statements)
+
+    cached_statements, total_statements = run_in_session(client, load)
+
+    assert cached_statements == 0
+    assert total_statements == 1
+
+
+def test_loader_is_scoped_to_its_session(client, user, statements):
+    card = user["categories"]["card"]
+
+    async def load(db):
+        await get_category_loader(db).load(card)
+        return get_category_loader(db)
+
+    first_loader = run_in_session(client, load)
+    statements.clear()
+    second_loader = run_in_session(client, load)
+
+    assert second_loader is not first_loader
+    assert len(statements) == 1
+
+
+def test_prime_and_forget(client, user, statements):
+    card, food = user["categories"]["card"], user["categories"]["food"]
+
+    async def load(db):
+        loader = get_category_loader(db)
+        categories = await loader.load_many([card, food])
+        loader.prime(list(categories.values()))
+        statements.clear()
+        await loader.load_many([card, food])
+        primed_statements = len(statements)
+
+        loader.forget(food)
+        await loader.load_many([card, food])
+        return primed_statements, len(statements)
+
+    primed_statements, total_statements = run_in_session(client, load)
+
+    assert primed_statements == 0
+    assert total_statements == 1
@@ -0,0 +1,29 @@
+import json
+import logging
+import logging.config
+from pathlib import Path
+
+import yaml
+
+import log_pipeline
+import metrics
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_logging_config_writes_records_through_one_listener(tmp_path):
+    config = yaml.safe_load((ROOT / "logging.yaml").read_text())
+    config["handlers"]["queue"]["filename"] = str(tmp_path / "logs.log")
+    root_handlers = logging.getLogger().handlers[:]
+    try:
+        # applying the config again replaces the listener instead of registering another gauge
+        logging.config.dictConfig(config)
+        logging.config.dictConfig(config)
+        logging.getLogger("test").warning("hello %s", "world")
+        log_pipeline.stop_queue_listener()
+    finally:
+        logging.getLogger().handlers[:] = root_handlers
+
+    assert [metric.name for metric in metrics.registry].count("log_queue_size") == 1
+    entries = [json.loads(line) for line in (tmp_path / "logs.log").read_text().splitlines()]
+    assert [entry["message"] for entry in entries] == ["hello world"]
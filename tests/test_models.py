@@ -0,0 +1,38 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from pydantic import ValidationError
+
+from models import CategoryCreate, TransactionCreate
+
+
+@pytest.mark.parametrize("amount", ["1e30", "1e12", "-1e12"])
+def test_category_amount_outside_money_column_is_rejected(amount):
+    with pytest.raises(ValidationError):
+        CategoryCreate(name="card", type=2, amount=amount)
+
+
+@pytest.mark.parametrize("amount", ["1e30", "1e12"])
+def test_transaction_amount_outside_money_column_is_rejected(amount):
+    with pytest.raises(ValidationError):
+        TransactionCreate(amount=amount, source=1, destination=2, timestamp=datetime.utcnow())
+
+
+def test_amount_is_rounded_to_cents():
+    transaction = TransactionCreate(amount="999999999999.994", source=1, destination=2, timestamp=datetime.utcnow())
+    assert transaction.amount == Decimal("999999999999.99")
+
+
+def test_oversized_amount_is_a_client_error(client, user):
+    body = {
+        "amount": "1e30",
+        "source": user["categories"]["salary"],
+        "destination": user["categories"]["card"],
+        "timestamp": user["timestamp"]
+    }
+    assert client.post("/income-account-transactions", json=body, headers=user["headers"]).status_code == 422
+
+    report = client.post("/transactions/import", json=[body, {**body, "amount": 1}], headers=user["headers"]).json()
+    assert report["imported"] == 1
+    assert [rejection["row"] for rejection in report["rejected"]] == [0]
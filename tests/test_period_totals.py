@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+import database_crud
+
+
+def test_import_upserts_period_totals_in_chunks(client, user, statements, monkeypatch):
+    monkeypatch.setattr(database_crud, "PERIOD_TOTAL_UPSERT_CHUNK_SIZE", 2)
+    this_month = datetime.utcnow().replace(day=15, hour=12)
+    rows = [
+        {
+            "amount": months + 1,
+            "source": user["categories"]["card"],
+            "destination": user["categories"]["rent"],
+            "timestamp": (this_month - relativedelta(months=months)).isoformat()
+        }
+        for months in range(5)
+    ]
+
+    statements.clear()
+    report = client.post("/transactions/import", json=rows, headers=user["headers"]).json()
+    assert report["imported"] == 5
+    # card and rent each get 5 months of deltas, upserted two rows at a time
+    assert sum(statement.startswith("INSERT INTO category_period_totals") for statement in statements) == 5
+
+    series = client.get("/time-series?type=3&period_offset_from=-4", headers=user["headers"]).json()
+    rent = series["amounts"][series["category_ids"].index(user["categories"]["rent"])]
+    assert rent == [5, 4, 3, 2, 1]
@@ -0,0 +1,61 @@
+import pytest
+
+
+def transfer(source: str, destination: str, amount: int = 5):
+    return lambda user: {
+        "amount": amount,
+        "source": user["categories"][source],
+        "destination": user["categories"][destination],
+        "timestamp": user["timestamp"]
+    }
+
+
+def constant(body):
+    return lambda user: body
+
+
+@pytest.mark.parametrize("method, path, body, expected", [
+    ("GET", "/users", None, 1),
+    ("GET", "/state", None, 7),
+    ("GET", "/state/stream", None, 4),
+    ("GET", "/changes", None, 1),
+    ("GET", "/changes?cursor=0", None, 4),
+    ("GET", "/settings", None, 2),
+    ("PATCH", "/settings", constant({"base_currency": 1}), 4),
+    ("GET", "/incomes", None, 3),
+    ("GET", "/accounts", None, 2),
+    ("GET", "/expenses", None, 3),
+    ("GET", "/time-series?type=3", None, 3),
+    ("GET", "/categories/{food}", None, 3),
+    ("POST", "/categories", constant({"name": "travel", "type": 3}), 4),
+    ("PATCH", "/categories/{food}", constant({"name": "groceries"}), 4),
+    ("DELETE", "/categories/{food}", None, 12),
+    ("GET", "/categories/{food}/transactions", None, 3),
+    ("POST", "/income-account-transactions", transfer("salary", "card"), 8),
+    ("POST", "/account-expense-transactions", transfer("card", "rent"), 8),
+    ("POST", "/transactions/import", lambda user: [transfer("card", "rent")(user), transfer("card", "food")(user)], 8),
+    ("PATCH", "/transactions/{transaction}", transfer("card", "rent", 7), 11),
+    ("DELETE", "/transactions/{transaction}", None, 8),
+])
+def test_endpoint_statement_count(client, user, statements, method, path, body, expected):
+    url = path.format(**user["categories"], transaction=user["transactions"][-1])
+    statements.clear()
+    response = client.request(method, url, json=None if body is None else body(user), headers=user["headers"])
+
+    assert response.status_code < 300, response.text
+    assert len(statements) == expected, "\n\n".join(statements)
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("POST", "/income-account-transactions", transfer("salary", "card")),
+    ("POST", "/account-expense-transactions", transfer("card", "food")),
+    ("PATCH", "/categories/{food}", constant({"name": "groceries"})),
+    ("PATCH", "/transactions/{transaction}", transfer("card", "rent", 7)),
+])
+def test_categories_are_selected_once_per_request(client, user, statements, method, path, body):
+    url = path.format(**user["categories"], transaction=user["transactions"][-1])
+    statements.clear()
+    response = client.request(method, url, json=body(user), headers=user["headers"])
+
+    assert response.status_code < 300, response.text
+    assert sum(statement.startswith("SELECT categories.") for statement in statements) == 1, "\n\n".join(statements)
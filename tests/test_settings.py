@@ -0,0 +1,19 @@
+import json
+from datetime import date
+
+from jose import jwt
+
+import auth
+from models import Settings
+
+
+def test_periods_ignore_settings_cached_by_another_worker(client, user):
+    client.patch("/settings", json={"start_date": "2026-01-15"}, headers=user["headers"])
+    settings = client.get("/settings", headers=user["headers"]).json()
+    # a worker that served the user before the update still caches the old start day
+    token = user["headers"]["Authorization"].removeprefix("Bearer ")
+    user_id = json.loads(jwt.get_unverified_claims(token)["sub"])["user_id"]
+    auth.principal_cache.set(user_id, Settings(**{**settings, "start_date": date(2026, 1, 1)}))
+
+    response = client.get("/time-series?type=3", headers=user["headers"])
+    assert {date.fromisoformat(day).day for day in response.json()["period_starts"]} == {15}
@@ -0,0 +1,18 @@
+from models import CategoryType, Currency
+
+
+def test_time_series_keeps_native_currencies_unless_converted(client, user):
+    travel = client.post(
+        "/categories",
+        json={"name": "travel", "type": CategoryType.EXPENSE.value, "currency": Currency.USD.value},
+        headers=user["headers"]
+    ).json()["id"]
+
+    series = client.get("/time-series?type=3&period_offset_from=0", headers=user["headers"]).json()
+    assert series["currency"] is None
+    currencies = dict(zip(series["category_ids"], series["currencies"]))
+    assert currencies[travel] == Currency.USD.value
+    assert currencies[user["categories"]["food"]] == Currency.EUR.value
+
+    # converting needs exchange rates, which the test database does not have
+    assert client.get("/time-series?type=3&convert=true", headers=user["headers"]).status_code == 400
@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+import database_crud
+
+
+class SerializationFailure(Exception):
+    pgcode = "40001"
+
+
+def always_conflict(monkeypatch, function_name: str) -> list[int]:
+    attempts = []
+
+    async def conflict(*args, **kwargs):
+        attempts.append(1)
+        raise DBAPIError("UPDATE", {}, SerializationFailure())
+
+    monkeypatch.setattr(database_crud, function_name, conflict)
+    monkeypatch.setattr(database_crud, "WRITE_RETRY_BASE_DELAY_SECONDS", 0)
+    return attempts
+
+
+@pytest.mark.parametrize("function_name, method, path, body", [
+    ("create_category", "POST", "/categories", {"name": "travel", "type": 3}),
+    ("update_category", "PATCH", "/categories/{food}", {"name": "groceries"}),
+    ("update_user_settings", "PATCH", "/settings", {"base_currency": 1}),
+])
+def test_write_is_retried_then_rejected_with_503(client, user, monkeypatch, function_name, method, path, body):
+    attempts = always_conflict(monkeypatch, function_name)
+    response = client.request(method, path.format(**user["categories"]), json=body, headers=user["headers"])
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert len(attempts) == database_crud.WRITE_RETRY_ATTEMPTS
+
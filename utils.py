@@ -1,18 +1,83 @@
-from datetime import datetime, date, timedelta
+import base64
+import json
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 
 from dateutil.relativedelta import relativedelta
 
 
-def round_float(value: float) -> float:
-    return round(value, 2)
+CENT = Decimal("0.01")
+# money columns are numeric(14, 2)
+MONEY_LIMIT = Decimal("1e12")
 
 
-def get_current_period() -> tuple:
-    return get_period(offset_months=0)
+def to_money(value) -> Decimal:
+    try:
+        return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation as error:
+        raise ValueError(f"{value} is not a valid amount") from error
 
 
-def get_period(offset_months: int) -> tuple:
-    now = datetime.utcnow()
-    start_date = date(now.year, now.month, 1) + relativedelta(months=offset_months)
-    end_date = start_date + relativedelta(months=1)
+def to_stored_money(value) -> Decimal:
+    money = to_money(value)
+    if abs(money) >= MONEY_LIMIT:
+        raise ValueError(f"amount should be less than {MONEY_LIMIT:.0f} in absolute value")
+    return money
+
+
+def get_current_period(start_day: int = 1) -> tuple:
+    return get_period(offset_months=0, start_day=start_day)
+
+
+def get_period(offset_months: int, start_day: int = 1) -> tuple:
+    today = datetime.utcnow().date()
+    anchor = date(today.year, today.month, 1)
+    if today < anchor + relativedelta(day=start_day):
+        anchor -= relativedelta(months=1)
+    start_date = anchor + relativedelta(months=offset_months, day=start_day)
+    end_date = anchor + relativedelta(months=offset_months + 1, day=start_day)
     return start_date, end_date
+
+
+def get_period_calendar(offset_from: int, offset_to: int, start_day: int = 1) -> list[tuple]:
+    return [get_period(offset, start_day) for offset in range(offset_from, offset_to + 1)]
+
+
+def get_month_starts(period_start: date, period_end: date) -> list[date]:
+    month = date(period_start.year, period_start.month, 1)
+    months = []
+    while month < period_end:
+        months.append(month)
+        month += relativedelta(months=1)
+    return months
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def get_month_start(value: datetime) -> date:
+    value = to_naive_utc(value)
+    return date(value.year, value.month, 1)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    return etag.removeprefix("W/") in {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+
+
+def encode_cursor(timestamp: datetime, entity_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), entity_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        timestamp, entity_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(entity_id)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"invalid cursor {cursor}") from error
@@ -1,9 +1,10 @@
-from typing import Any
+from typing import Any, Collection
 
 from fastapi import HTTPException
 
 from database_models import CategoryDb, TransactionDb, UserDb
 from models import CategoryType
+import utils
 
 
 def validate_none_value(value: any, entity_name: str, status_code: int = 404):
@@ -20,7 +21,7 @@ def validate_entity_exists_in_list(
         entity_id: int,
         entity_name: str,
         value: Any,
-        value_list: list[Any],
+        value_list: Collection[Any],
         status_code: int = 404
 ):
     if value not in value_list:
@@ -43,7 +44,7 @@ def validate_not_changing_category_type(new_category_type: int, category_type: i
             raise HTTPException(status_code=400, detail="category type can not be changed")
 
 
-def validate_source_destination_exist(source: int, destination: int, categories_id: list[int]):
+def validate_source_destination_exist(source: int, destination: int, categories_id: Collection[int]):
     validate_entity_exists_in_list(source, 'source', source, categories_id)
     validate_entity_exists_in_list(destination, 'source', destination, categories_id)
 
@@ -66,3 +67,62 @@ def validate_account_expense_source_type(category_type):
 def validate_account_expense_destination_type(category_type):
     if category_type != CategoryType.ACCOUNT.value and category_type != CategoryType.EXPENSE.value:
         raise HTTPException(status_code=400, detail="destination should be account or expense")
+
+
+def validate_cursor(cursor: str):
+    if cursor is None:
+        return
+    try:
+        utils.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"cursor {cursor} is invalid")
+
+
+def validate_transaction_direction(source_type: int, destination_type: int):
+    if source_type == CategoryType.INCOME.value:
+        validate_income_account_destination_type(destination_type)
+    else:
+        validate_account_expense_source_type(source_type)
+        validate_account_expense_destination_type(destination_type)
+
+
+def validate_category_type(category_type: int):
+    if category_type not in {member.value for member in CategoryType}:
+        raise HTTPException(status_code=400, detail=f"category type {category_type} is unknown")
+
+
+def validate_period_range(period_offset_from: int, period_offset_to: int, max_months: int):
+    if period_offset_from > period_offset_to:
+        raise HTTPException(status_code=400, detail="period_offset_from should not be after period_offset_to")
+    if period_offset_to - period_offset_from >= max_months:
+        raise HTTPException(status_code=400, detail=f"time series is limited to {max_months} months")
+
+
+def validate_exchange_rates(rate_index, currencies: Collection[int]):
+    for currency in sorted(currencies):
+        if not rate_index.has_currency(currency):
+            raise HTTPException(status_code=400, detail=f"no exchange rate for currency {currency}")
+
+
+def raise_write_conflict(conflict: Exception):
+    raise HTTPException(
+        status_code=503, detail="too many concurrent writes, try again later", headers={"Retry-After": "1"}
+    ) from conflict
+
+
+def validate_idempotent_replay(idempotency_key: str, stored_request_hash: str, request_hash: str):
+    if stored_request_hash != request_hash:
+        raise HTTPException(status_code=422, detail=f"idempotency key {idempotency_key} was used for another request")
+
+
+def validate_idempotent_resource_exists(idempotency_key: str, resource: Any):
+    if resource is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"request with idempotency key {idempotency_key} was processed but its result no longer exists"
+        )
+
+
+def validate_import_size(rows: list, max_rows: int):
+    if len(rows) > max_rows:
+        raise HTTPException(status_code=413, detail=f"import is limited to {max_rows} rows")